@@ -6,26 +6,33 @@ from zoneinfo import ZoneInfo
 
 from dotenv import load_dotenv
 
-load_dotenv()
+# Child processes and module reloads inherit the already-populated environment
+if not os.environ.get("LUNARIS_ENV_LOADED"):
+    load_dotenv()
+    os.environ["LUNARIS_ENV_LOADED"] = "1"
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 LOGS_DIR = BASE_DIR / "logs"
 
-DATA_DIR.mkdir(exist_ok=True)
-LOGS_DIR.mkdir(exist_ok=True)
+for _dir in (DATA_DIR, LOGS_DIR):
+    if not _dir.is_dir():
+        _dir.mkdir(parents=True, exist_ok=True)
 
-TELEGRAM_BOT_TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
-ANTHROPIC_API_KEY = os.environ["ANTHROPIC_API_KEY"]
-ADMIN_CHAT_ID = int(os.environ["ADMIN_CHAT_ID"])
+_env = os.environ
+_get = _env.get
 
-CHAT_MODEL = os.getenv("CHAT_MODEL", "claude-sonnet-4-6")
-MAX_CHAT_HISTORY = int(os.getenv("MAX_CHAT_HISTORY", "20"))
+TELEGRAM_BOT_TOKEN = _env["TELEGRAM_BOT_TOKEN"]
+ANTHROPIC_API_KEY = _env["ANTHROPIC_API_KEY"]
+ADMIN_CHAT_ID = int(_env["ADMIN_CHAT_ID"])
 
-CYCLE_LENGTH = int(os.getenv("CYCLE_LENGTH", "28"))
-LAST_PERIOD_START = os.getenv("LAST_PERIOD_START", "2026-01-28")
+CHAT_MODEL = _get("CHAT_MODEL", "claude-sonnet-4-6")
+MAX_CHAT_HISTORY = int(_get("MAX_CHAT_HISTORY", "20"))
 
-REMINDER_HOUR = int(os.getenv("REMINDER_HOUR", "9"))
-TIMEZONE = ZoneInfo(os.getenv("TIMEZONE", "Asia/Tehran"))
+CYCLE_LENGTH = int(_get("CYCLE_LENGTH", "28"))
+LAST_PERIOD_START = _get("LAST_PERIOD_START", "2026-01-28")
+
+REMINDER_HOUR = int(_get("REMINDER_HOUR", "9"))
+TIMEZONE = ZoneInfo(_get("TIMEZONE", "Asia/Tehran"))
 
 DB_PATH = DATA_DIR / "lunaris.db"
@@ -1,9 +1,18 @@
+from functools import lru_cache
+
 import anthropic
 
 from config.settings import ANTHROPIC_API_KEY, CHAT_MODEL, MAX_CHAT_HISTORY
 
-client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=3)
 
+@lru_cache(maxsize=1)
+def _get_client() -> anthropic.AsyncAnthropic:
+    """Create the Anthropic client on first use instead of at import."""
+    return anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=3)
+
+
+# Sent as a plain string: at ~150 tokens it is below the minimum length
+# Anthropic will cache, so a cache_control marker would do nothing
 SYSTEM_PROMPT = """You're a very caring, warm, and funny friend who knows a lot about women's health.
 You call her "darling" naturally — like a close friend who truly adores her.
 Keep it casual and conversational, not clinical.
@@ -41,17 +50,53 @@ Tone & style:
 {cycle_context}"""
 
 
+def _cached_text_block(text: str) -> dict:
+    """Text content block marked for Anthropic prompt caching."""
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+_PHASE_PROMPTS = {
+    "pms": "She's in the PMS phase. Write a sweet, kind morning message to cheer her up. Call her darling. Witty but respectful.",
+    "menstruation": "She's on her period. Write a warm, loving message. Call her darling. Add some subtle humor to make her smile.",
+    "ovulation": "It's ovulation day! Write an energetic, uplifting message. Call her darling.",
+}
+_DEFAULT_PROMPT = "Write an encouraging and sweet daily message. Call her darling."
+
+# Split once so each chat turn concatenates instead of re-parsing the template
+_CHAT_PREFIX, _CHAT_SUFFIX = CHAT_SYSTEM_PROMPT.split("{cycle_context}")
+
+
+def _recent_notes(recent_logs: list[dict] | None) -> tuple[str, ...]:
+    return tuple(log["note"] for log in recent_logs[:3]) if recent_logs else ()
+
+
+@lru_cache(maxsize=256)
+def _format_notes(notes: tuple[str, ...]) -> str:
+    return "Recent notes:\n" + "\n".join(f"- {note}" for note in notes)
+
+
 def _format_logs_context(recent_logs: list[dict] | None) -> str:
-    if not recent_logs:
+    notes = _recent_notes(recent_logs)
+    if not notes:
+        return ""
+    return "\n\n" + _format_notes(notes)
+
+
+@lru_cache(maxsize=256)
+def _build_cycle_context(cycle_day: int | None, phase: str | None, age: int | None, notes: tuple[str, ...]) -> str:
+    if not (cycle_day and phase):
         return ""
-    log_texts = [f"- {log['note']}" for log in recent_logs[:3]]
-    return "\n\nRecent notes:\n" + "\n".join(log_texts)
+    cycle_context = f"Her current cycle info: Day {cycle_day}, phase: {phase}."
+    if age:
+        cycle_context += f" She is approximately {age} years old."
+    if notes:
+        cycle_context += "\n" + _format_notes(notes)
+    return cycle_context
 
 
 def _extract_text(response) -> str:
-    if response.content:
-        return response.content[0].text
-    return "I'm having a moment, darling — try again in a sec!"
+    content = response.content
+    return content[0].text if content else "I'm having a moment, darling — try again in a sec!"
 
 
 async def generate_tip(phase: str, cycle_day: int, recent_logs: list[dict] | None = None, model: str = "claude-sonnet-4-6", age: int | None = None) -> str:
@@ -63,7 +108,7 @@ async def generate_tip(phase: str, cycle_day: int, recent_logs: list[dict] | Non
 
 Give a short, encouraging tip to help her feel better."""
 
-    response = await client.messages.create(
+    response = await _get_client().messages.create(
         model=model,
         max_tokens=300,
         system=SYSTEM_PROMPT,
@@ -77,19 +122,13 @@ async def generate_reminder(phase: str, cycle_day: int, recent_logs: list[dict]
     logs_context = _format_logs_context(recent_logs)
     age_context = f" She is approximately {age} years old." if age else ""
 
-    phase_prompts = {
-        "pms": "She's in the PMS phase. Write a sweet, kind morning message to cheer her up. Call her darling. Witty but respectful.",
-        "menstruation": "She's on her period. Write a warm, loving message. Call her darling. Add some subtle humor to make her smile.",
-        "ovulation": "It's ovulation day! Write an energetic, uplifting message. Call her darling.",
-    }
-
-    prompt = phase_prompts.get(phase, "Write an encouraging and sweet daily message. Call her darling.")
+    prompt = _PHASE_PROMPTS.get(phase, _DEFAULT_PROMPT)
 
     user_msg = f"""Day {cycle_day} of cycle — phase: {phase}{age_context}{logs_context}
 
 {prompt}"""
 
-    response = await client.messages.create(
+    response = await _get_client().messages.create(
         model="claude-haiku-4-5-20251001",
         max_tokens=300,
         system=SYSTEM_PROMPT,
@@ -107,21 +146,17 @@ async def generate_chat_response(
     age: int | None = None,
 ) -> str:
     """Generate a free-form AI chat response with cycle-aware context."""
-    cycle_context = ""
-    if cycle_day and phase:
-        cycle_context = f"Her current cycle info: Day {cycle_day}, phase: {phase}."
-        if age:
-            cycle_context += f" She is approximately {age} years old."
-        if recent_logs:
-            log_texts = [f"- {log['note']}" for log in recent_logs[:3]]
-            cycle_context += "\nRecent notes:\n" + "\n".join(log_texts)
-
-    system = CHAT_SYSTEM_PROMPT.format(cycle_context=cycle_context)
+    cycle_context = _build_cycle_context(cycle_day, phase, age, _recent_notes(recent_logs))
+    system = [_cached_text_block(_CHAT_PREFIX + cycle_context + _CHAT_SUFFIX)]
 
     messages = [{"role": m["role"], "content": m["content"]} for m in chat_history]
+    if messages:
+        # Cache breakpoint at the end of stored history so the next turn reuses the prefix
+        last = messages[-1]
+        last["content"] = [_cached_text_block(last["content"])]
     messages.append({"role": "user", "content": user_message})
 
-    response = await client.messages.create(
+    response = await _get_client().messages.create(
         model=CHAT_MODEL,
         max_tokens=600,
         system=system,
@@ -1,12 +1,18 @@
+import asyncio
 import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
-from telegram import BotCommand, BotCommandScopeChat
+from telegram import BotCommand, BotCommandScopeChat, Update
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
+    Defaults,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
@@ -18,95 +24,178 @@ from config.settings import (
     DB_PATH,
     LOGS_DIR,
 )
-from src.db import Database
-from src.handlers import (
-    start_command,
-    status_command,
-    tip_command,
-    period_command,
-    log_command,
-    history_command,
-    next_command,
-    phase_command,
-    adjust_command,
-    settings_command,
-    button_handler,
-    adduser_command,
-    removeuser_command,
-    users_command,
-    setup_command,
-    clearchat_command,
-    chat_handler,
-    about_command,
-)
-from src.scheduler import setup_scheduler
 
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Set by _start_logging: handlers run on this listener's background thread so
+# log calls from the event loop only enqueue the record instead of writing to
+# disk synchronously
+_log_listener: QueueListener | None = None
+
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
+def _start_logging() -> None:
+    """Route logging through a queue to the file and console handlers."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    handlers = [
         RotatingFileHandler(
             LOGS_DIR / "lunaris.log",
             maxBytes=10 * 1024 * 1024,
             backupCount=5,
         ),
         logging.StreamHandler(),
-    ],
-)
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # Leave the full layout to the listener's handlers; only the message is rendered here
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    _log_listener = QueueListener(log_queue, *handlers)
+    _log_listener.start()
+
+
+def _stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
 logger = logging.getLogger(__name__)
 
 
+USER_COMMANDS = [
+    BotCommand("start", "Welcome & main menu"),
+    BotCommand("status", "Current cycle day & phase"),
+    BotCommand("tip", "AI-generated caring tip"),
+    BotCommand("period", "Log period start"),
+    BotCommand("log", "Log mood or symptom"),
+    BotCommand("history", "Recent logs"),
+    BotCommand("next", "Predicted dates"),
+    BotCommand("phase", "Detailed phase info"),
+    BotCommand("adjust", "Update last period date"),
+    BotCommand("settings", "View/update cycle length"),
+    BotCommand("setup", "Set up your cycle info"),
+    BotCommand("clearchat", "Clear AI chat history"),
+    BotCommand("about", "About this bot"),
+]
+ADMIN_COMMANDS = USER_COMMANDS + [
+    BotCommand("adduser", "Whitelist a user"),
+    BotCommand("removeuser", "Remove a user"),
+    BotCommand("users", "List whitelisted users"),
+]
+
+# Strong references to fire-and-forget tasks so they aren't garbage-collected
+_background_tasks: set[asyncio.Task] = set()
+
+
 async def post_init(application):
-    """Register bot commands menu on startup.
+    """Start the chat history writer and register bot commands menu on startup.
 
     Default menu shows regular commands only.
     Admin gets an additional scoped menu with admin commands.
     """
-    user_commands = [
-        BotCommand("start", "Welcome & main menu"),
-        BotCommand("status", "Current cycle day & phase"),
-        BotCommand("tip", "AI-generated caring tip"),
-        BotCommand("period", "Log period start"),
-        BotCommand("log", "Log mood or symptom"),
-        BotCommand("history", "Recent logs"),
-        BotCommand("next", "Predicted dates"),
-        BotCommand("phase", "Detailed phase info"),
-        BotCommand("adjust", "Update last period date"),
-        BotCommand("settings", "View/update cycle length"),
-        BotCommand("setup", "Set up your cycle info"),
-        BotCommand("clearchat", "Clear AI chat history"),
-        BotCommand("about", "About this bot"),
-    ]
-    admin_commands = user_commands + [
-        BotCommand("adduser", "Whitelist a user"),
-        BotCommand("removeuser", "Remove a user"),
-        BotCommand("users", "List whitelisted users"),
-    ]
+    # Batched chat history writes need the running event loop
+    from src.db import ChatHistoryWriter
 
-    # Default menu for all users — no admin commands visible
-    await application.bot.set_my_commands(user_commands)
+    writer = ChatHistoryWriter(application.bot_data["db"])
+    writer.start()
+    application.bot_data["chat_writer"] = writer
 
-    # Admin-only menu — includes admin commands
-    await application.bot.set_my_commands(
-        admin_commands,
-        scope=BotCommandScopeChat(chat_id=ADMIN_CHAT_ID),
+    # Default menu for all users — no admin commands visible
+    await application.bot.set_my_commands(USER_COMMANDS)
+
+    # Admin-only menu — includes admin commands. Not needed to start serving
+    # users, so register it in the background instead of delaying startup.
+    task = asyncio.create_task(
+        application.bot.set_my_commands(
+            ADMIN_COMMANDS,
+            scope=BotCommandScopeChat(chat_id=ADMIN_CHAT_ID),
+        )
     )
+    _background_tasks.add(task)
+    task.add_done_callback(_on_admin_menu_done)
+
+
+async def post_shutdown(application):
+    """Flush queued chat history and log records before the process exits."""
+    writer = application.bot_data.get("chat_writer")
+    if writer:
+        await writer.aclose()
+    _stop_logging()
+
+
+def _on_admin_menu_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Failed to register admin command menu: %s", task.exception())
 
 
 def create_app() -> None:
     """Create and run the bot application."""
+    # Imported here so `import src.bot` stays cheap; these pull in the
+    # Anthropic SDK, APScheduler and SQLite only when the bot actually starts.
+    from src.db import Database
+    from src.handlers import (
+        prepare_update,
+        start_command,
+        status_command,
+        tip_command,
+        period_command,
+        log_command,
+        history_command,
+        next_command,
+        phase_command,
+        adjust_command,
+        settings_command,
+        button_handler,
+        adduser_command,
+        removeuser_command,
+        users_command,
+        setup_command,
+        clearchat_command,
+        chat_handler,
+        about_command,
+    )
+    from src.scheduler import setup_scheduler
+
+    _start_logging()
     logger.info("Starting Lunaris bot...")
 
-    # Initialize database and bootstrap admin
+    # Initialize database and bootstrap admin; the migration runs on a worker
+    # thread while the application is being built
     db = Database(DB_PATH)
-    db.bootstrap_admin(ADMIN_CHAT_ID, CYCLE_LENGTH, LAST_PERIOD_START)
-    logger.info(f"Admin {ADMIN_CHAT_ID} bootstrapped (legacy data migrated if needed)")
-
-    # Build application
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
-    app.bot_data["db"] = db
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bootstrap") as executor:
+        bootstrap = executor.submit(db.bootstrap_admin, ADMIN_CHAT_ID, CYCLE_LENGTH, LAST_PERIOD_START)
+
+        # Build application
+        app = (
+            ApplicationBuilder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            # Throttle outgoing calls to Telegram's flood limits instead of
+            # eating 429s; one retry after the server-provided wait
+            .rate_limiter(AIORateLimiter(max_retries=1))
+            # Bot API calls share one multiplexed HTTP/2 connection; long
+            # polling keeps its own default request
+            .http_version("2")
+            .connection_pool_size(32)
+            # Handlers run as tasks so one user's AI call doesn't hold up
+            # everyone else; per-chat locks in handlers keep a user serialized
+            .defaults(Defaults(block=False))
+            .build()
+        )
+        app.bot_data["db"] = db
+
+        bootstrap.result()  # re-raises if the migration failed
+    logger.info("Admin %s bootstrapped (legacy data migrated if needed)", ADMIN_CHAT_ID)
 
     # Register command handlers
     commands = [
@@ -129,12 +218,14 @@ def create_app() -> None:
         ("clearchat", clearchat_command),
         ("about", about_command),
     ]
-    for name, handler in commands:
-        app.add_handler(CommandHandler(name, handler))
-    app.add_handler(CallbackQueryHandler(button_handler))
+    handlers = [CommandHandler(name, handler) for name, handler in commands]
+    handlers.append(CallbackQueryHandler(button_handler))
 
     # Free-form AI chat — registered LAST so it only catches non-command text
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, chat_handler))
+    handlers.append(MessageHandler(filters.TEXT & ~filters.COMMAND, chat_handler))
+    app.add_handlers(handlers)
+    # Group -1 runs (and is awaited) before every handler above
+    app.add_handler(TypeHandler(Update, prepare_update, block=True), group=-1)
 
     # Set up scheduler
     scheduler = setup_scheduler(app)
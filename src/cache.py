@@ -0,0 +1,62 @@
+import threading
+import time
+from collections.abc import Callable
+
+CONFIG_CACHE_TTL = 300.0
+CONFIG_CACHE_SIZE = 1024
+
+
+class ConfigCache:
+    """TTL cache of per-chat user state (auth flags + cycle config), keyed by chat_id.
+
+    Database owns the only instance and invalidates an entry on every write to
+    that user's row or config; the TTL only bounds staleness from writes made
+    outside the bot process.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int], dict],
+        ttl: float = CONFIG_CACHE_TTL,
+        maxsize: int = CONFIG_CACHE_SIZE,
+    ):
+        self._loader = loader
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._entries: dict[int, tuple[float, dict]] = {}
+        # Database is used from the event loop and from worker threads
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: int) -> dict:
+        """Cached state for chat_id, loaded on a miss; shared, treat as read-only."""
+        now = time.monotonic()
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        state = self._loader(chat_id)
+        with self._lock:
+            # Re-insert at the end so dict order stays oldest-first for eviction
+            self._entries.pop(chat_id, None)
+            if len(self._entries) >= self._maxsize:
+                self._evict(now)
+            self._entries[chat_id] = (now + self._ttl, state)
+        return state
+
+    def invalidate(self, chat_id: int) -> None:
+        with self._lock:
+            self._entries.pop(chat_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float) -> None:
+        expired = [cid for cid, (expires, _) in self._entries.items() if expires <= now]
+        for cid in expired:
+            del self._entries[cid]
+        if len(self._entries) >= self._maxsize:
+            # Still full of live entries: drop the oldest
+            del self._entries[next(iter(self._entries))]
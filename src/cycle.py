@@ -1,32 +1,60 @@
 from datetime import date, timedelta
+from functools import lru_cache
 
 
-def get_cycle_day(last_period_start: date, today: date, cycle_length: int = 28) -> int:
-    """Return current cycle day (1-based). Auto-wraps if past cycle_length."""
-    delta = (today - last_period_start).days
+@lru_cache(maxsize=1024)
+def _cycle_day_ord(last_period_ord: int, today_ord: int, cycle_length: int) -> int:
+    delta = today_ord - last_period_ord
     if delta < 0:
         return 1
     return (delta % cycle_length) + 1
 
 
-def get_phase(cycle_day: int, cycle_length: int = 28, period_duration: int = 5) -> str:
-    """Return the current phase name based on cycle day with proportional boundaries.
+def get_cycle_day(last_period_start: date, today: date, cycle_length: int = 28) -> int:
+    """Return current cycle day (1-based). Auto-wraps if past cycle_length."""
+    return _cycle_day_ord(last_period_start.toordinal(), today.toordinal(), cycle_length)
 
-    Medical model: luteal phase is fixed at ~14 days before end of cycle.
-    """
+
+MENSTRUATION, FOLLICULAR, OVULATION, LUTEAL, PMS = range(5)
+PHASE_NAMES = ("menstruation", "follicular", "ovulation", "luteal", "pms")
+
+
+def _classify_phase(cycle_day: int, cycle_length: int, period_duration: int) -> int:
+    """Branching phase rule; backs the lookup table and out-of-range days."""
     ovulation_day = max(cycle_length - 14, period_duration + 1)
     pms_start = cycle_length - 6
 
     if 1 <= cycle_day <= period_duration:
-        return "menstruation"
+        return MENSTRUATION
     elif period_duration < cycle_day < ovulation_day:
-        return "follicular"
+        return FOLLICULAR
     elif cycle_day == ovulation_day:
-        return "ovulation"
+        return OVULATION
     elif ovulation_day < cycle_day < pms_start:
-        return "luteal"
+        return LUTEAL
     else:
-        return "pms"
+        return PMS
+
+
+@lru_cache(maxsize=32)
+def _phase_table(cycle_length: int, period_duration: int) -> tuple[int, ...]:
+    """Phase index for every cycle day 0..cycle_length, built once per config."""
+    return tuple(_classify_phase(day, cycle_length, period_duration) for day in range(cycle_length + 1))
+
+
+def _phase_index(cycle_day: int, cycle_length: int, period_duration: int) -> int:
+    table = _phase_table(cycle_length, period_duration)
+    if 0 <= cycle_day < len(table):
+        return table[cycle_day]
+    return _classify_phase(cycle_day, cycle_length, period_duration)
+
+
+def get_phase(cycle_day: int, cycle_length: int = 28, period_duration: int = 5) -> str:
+    """Return the current phase name based on cycle day with proportional boundaries.
+
+    Medical model: luteal phase is fixed at ~14 days before end of cycle.
+    """
+    return PHASE_NAMES[_phase_index(cycle_day, cycle_length, period_duration)]
 
 
 PHASE_LABELS = {
@@ -45,15 +73,20 @@ PHASE_DESCRIPTIONS = {
     "pms": "PMS has entered the chat darling. If everything's annoying, it's not you, it's hormones \U0001f49c",
 }
 
+# Index-aligned with PHASE_NAMES so the hot path avoids string-keyed lookups
+_LABELS_BY_INDEX = tuple(PHASE_LABELS[name] for name in PHASE_NAMES)
+_DESCRIPTIONS_BY_INDEX = tuple(PHASE_DESCRIPTIONS[name] for name in PHASE_NAMES)
 
-def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int = 5) -> str:
-    """Return phase detail text with proportional day ranges."""
+
+@lru_cache(maxsize=32)
+def _build_details(cycle_length: int, period_duration: int) -> dict[str, str]:
+    """Render all phase detail texts for one (cycle_length, period_duration) config."""
     ovulation_day = max(cycle_length - 14, period_duration + 1)
     pms_start = cycle_length - 6
 
-    details = {
+    return {
         "menstruation": (
-            f"\U0001fa78 *Period Phase (Day 1-{period_duration})*\n\n"
+            f"\U0001fa78 <b>Period Phase (Day 1-{period_duration})</b>\n\n"
             "Your body is shedding the uterine lining, darling.\n"
             "Cramps, back pain, fatigue, mood swings \u2014 the whole package.\n"
             "Not exactly a party, but it'll pass! \U0001f4aa\n\n"
@@ -64,7 +97,7 @@ def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int =
             "- Light exercise like walking"
         ),
         "follicular": (
-            f"\U0001f331 *Follicular Phase (Day {period_duration + 1}-{ovulation_day - 1})*\n\n"
+            f"\U0001f331 <b>Follicular Phase (Day {period_duration + 1}-{ovulation_day - 1})</b>\n\n"
             "Energy's coming back darling! Estrogen is rising \U0001f338\n"
             "Creativity and focus are at their best.\n"
             "You're the best version of yourself right now, enjoy it!\n\n"
@@ -74,7 +107,7 @@ def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int =
             "- Nutritious, protein-rich meals"
         ),
         "ovulation": (
-            f"\u2728 *Ovulation (Day {ovulation_day})*\n\n"
+            f"\u2728 <b>Ovulation (Day {ovulation_day})</b>\n\n"
             "Peak energy, confidence, and social drive, darling!\n"
             "Fertility is at its highest.\n"
             "You can conquer anything today \U0001f451\n\n"
@@ -84,7 +117,7 @@ def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int =
             "- Be social!"
         ),
         "luteal": (
-            f"\U0001f319 *Luteal Phase (Day {ovulation_day + 1}-{pms_start - 1})*\n\n"
+            f"\U0001f319 <b>Luteal Phase (Day {ovulation_day + 1}-{pms_start - 1})</b>\n\n"
             "Progesterone is rising darling. Your body is preparing.\n"
             "Energy might dip a bit \u2014 that's totally normal.\n"
             "Time to slow down, the world isn't going anywhere \U0001fac2\n\n"
@@ -94,7 +127,7 @@ def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int =
             "- Moderate exercise like yoga"
         ),
         "pms": (
-            f"\u26a1 *PMS Phase (Day {pms_start}-{cycle_length})*\n\n"
+            f"\u26a1 <b>PMS Phase (Day {pms_start}-{cycle_length})</b>\n\n"
             "Hormones are shifting, darling.\n"
             "Sensitivity, mood swings, fatigue, cravings \u2014 all normal.\n"
             "If you wanna yell at everyone, that's the hormones talking, not you \U0001f49c\n\n"
@@ -105,36 +138,49 @@ def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int =
             "- Walking and deep breathing"
         ),
     }
+
+
+def get_phase_detail(phase: str, cycle_length: int = 28, period_duration: int = 5) -> str:
+    """Return phase detail text with proportional day ranges."""
+    details = _build_details(cycle_length, period_duration)
     return details.get(phase, PHASE_DESCRIPTIONS.get(phase, ""))
 
 
-# Keep static PHASE_DETAILS for backward compatibility (default 28-day/5-day values)
-PHASE_DETAILS = {phase: get_phase_detail(phase) for phase in PHASE_LABELS}
+def __getattr__(name: str):
+    # Static PHASE_DETAILS kept for backward compatibility (default 28-day/5-day
+    # values); only rendered if a legacy caller actually asks for it.
+    if name == "PHASE_DETAILS":
+        global PHASE_DETAILS
+        PHASE_DETAILS = dict(_build_details(28, 5))
+        return PHASE_DETAILS
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_phase_info(cycle_day: int, cycle_length: int = 28, period_duration: int = 5) -> dict:
     """Return detailed phase info."""
-    phase = get_phase(cycle_day, cycle_length, period_duration)
+    index = _phase_index(cycle_day, cycle_length, period_duration)
     return {
         "cycle_day": cycle_day,
-        "phase": phase,
-        "label": PHASE_LABELS[phase],
-        "description": PHASE_DESCRIPTIONS[phase],
+        "phase": PHASE_NAMES[index],
+        "label": _LABELS_BY_INDEX[index],
+        "description": _DESCRIPTIONS_BY_INDEX[index],
     }
 
 
-def predict_dates(last_period_start: date, cycle_length: int = 28) -> dict:
+def predict_dates(last_period_start: date, cycle_length: int = 28, today: date | None = None) -> dict:
     """Predict next period, PMS start, and ovulation dates from last period start."""
     next_period = last_period_start + timedelta(days=cycle_length)
     next_pms = last_period_start + timedelta(days=cycle_length - 7)
     next_ovulation = last_period_start + timedelta(days=cycle_length - 15)
 
-    today = date.today()
-    # If predicted dates are in the past, advance by one cycle
-    while next_period <= today:
-        next_period += timedelta(days=cycle_length)
-        next_pms += timedelta(days=cycle_length)
-        next_ovulation += timedelta(days=cycle_length)
+    today = today or date.today()
+    # If predicted dates are in the past, advance by as many whole cycles as needed
+    days_behind = (today - next_period).days
+    if days_behind >= 0:
+        shift = timedelta(days=(days_behind // cycle_length + 1) * cycle_length)
+        next_period += shift
+        next_pms += shift
+        next_ovulation += shift
 
     return {
         "next_period": next_period,
@@ -148,10 +194,15 @@ def days_until(target: date, today: date | None = None) -> int:
     return (target - today).days
 
 
-def get_current_cycle_start(last_period_start: date, today: date, cycle_length: int = 28) -> date:
-    """Get the start date of the current cycle."""
-    delta = (today - last_period_start).days
+@lru_cache(maxsize=1024)
+def _cycle_start_ord(last_period_ord: int, today_ord: int, cycle_length: int) -> int:
+    delta = today_ord - last_period_ord
     if delta < 0:
-        return last_period_start
+        return last_period_ord
     cycles_passed = delta // cycle_length
-    return last_period_start + timedelta(days=cycles_passed * cycle_length)
+    return last_period_ord + cycles_passed * cycle_length
+
+
+def get_current_cycle_start(last_period_start: date, today: date, cycle_length: int = 28) -> date:
+    """Get the start date of the current cycle."""
+    return date.fromordinal(_cycle_start_ord(last_period_start.toordinal(), today.toordinal(), cycle_length))
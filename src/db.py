@@ -1,25 +1,161 @@
+import asyncio
+import logging
 import sqlite3
-import statistics
-from datetime import date, datetime
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from datetime import date, datetime, timezone
 from pathlib import Path
+from typing import NamedTuple
+
+from src.cache import ConfigCache
+from src.cycle import PHASE_LABELS
+
+logger = logging.getLogger(__name__)
+
+# Room for every distinct SQL string in this module so none is ever evicted
+# from sqlite3's per-connection prepared statement cache and re-parsed.
+STATEMENT_CACHE_SIZE = 256
+
+# Shared by the single-purpose readers and get_chat_bundle
+_RECENT_LOGS_MINIMAL_SQL = (
+    "SELECT date, note FROM user_mood_logs WHERE chat_id = ? ORDER BY created_at DESC LIMIT ?"
+)
+# Newest `limit` rows picked via the index, returned oldest-first
+_CHAT_HISTORY_SQL = """
+    SELECT role, content FROM (
+        SELECT id, role, content FROM chat_history
+        WHERE chat_id = ? ORDER BY id DESC LIMIT ?
+    ) ORDER BY id
+"""
+
+
+class ChatBundle(NamedTuple):
+    """What chat_handler reads from the DB per message."""
+    recent_logs: list[sqlite3.Row]
+    history: list[dict]
+
+
+# Bump whenever _init_db/_migrate_schema change; stored in PRAGMA user_version
+SCHEMA_VERSION = 4
+
+# Per-chat lookup tables; WITHOUT ROWID stores each row directly in the
+# chat_id primary key B-tree instead of a rowid table plus a separate index
+_WITHOUT_ROWID_TABLES = {
+    "users": """(
+        chat_id INTEGER PRIMARY KEY,
+        added_by INTEGER,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        is_active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )""",
+    "user_cycle_config": """(
+        chat_id INTEGER PRIMARY KEY,
+        cycle_length INTEGER NOT NULL DEFAULT 28,
+        last_period_date TEXT NOT NULL,
+        period_duration INTEGER NOT NULL DEFAULT 5,
+        year_of_birth INTEGER,
+        FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+    )""",
+}
+
+
+# Resolve phase -> display label inside the query; unknown phases fall through as-is
+_PHASE_LABEL_SQL = "CASE phase {} ELSE phase END".format(" ".join(
+    "WHEN '{}' THEN '{}'".format(phase, label.replace("'", "''"))
+    for phase, label in PHASE_LABELS.items()
+))
+
+
+def _utc_now() -> str:
+    """Current UTC time in the same format as SQLite's datetime('now')."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
 
 class Database:
     def __init__(self, db_path: Path):
         self.db_path = db_path
-        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
-        self._conn.row_factory = sqlite3.Row
-        self._conn.execute("PRAGMA journal_mode=WAL")
-        self._conn.execute("PRAGMA foreign_keys = ON")
-        self._conn.execute("PRAGMA busy_timeout=5000")
-        self._init_db()
-        self._migrate_schema()
+        # One writer and one reader connection per thread, opened on first use,
+        # so threads never share (and serialize on) a connection
+        self._local = threading.local()
+        conn = self._local.conn = self._connect(db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        if self._get_schema_version() < SCHEMA_VERSION:
+            self._init_db()
+        conn.execute("PRAGMA foreign_keys = ON")
+
+        # Separate read-only connections: under WAL, SELECT-only methods read
+        # the last committed snapshot and never queue behind the writer.
+        self._reader_uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+
+        # The one cache of per-user auth + config; every method below that
+        # writes a user's row or config invalidates that user's entry
+        self._state_cache = ConfigCache(self._load_user_state)
+
+    @staticmethod
+    def _connect(database, uri: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            database,
+            uri=uri,
+            # Autocommit: transactions are opened explicitly by _txn()
+            isolation_level=None,
+            # Only str/int/None are ever bound and dates are stored as ISO
+            # text, so skip type detection and keep the C binding fast path
+            detect_types=0,
+            timeout=10,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=5000")
+        # WAL makes synchronous=NORMAL durable across app crashes; commits no
+        # longer fsync, only checkpoints do
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory-mapped reads
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        return conn
 
     def _get_conn(self) -> sqlite3.Connection:
-        return self._conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect(self.db_path)
+            conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def _get_read_conn(self) -> sqlite3.Connection:
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = self._local.reader = self._connect(self._reader_uri, uri=True)
+            reader.execute("PRAGMA query_only=1")
+        return reader
+
+    @contextmanager
+    def _txn(self) -> Iterator[sqlite3.Connection]:
+        """Run the block in a BEGIN IMMEDIATE transaction on the writer connection.
+
+        Taking the write lock up front avoids deferred-to-write upgrades that
+        fail with SQLITE_BUSY when another writer got there first.
+        """
+        conn = self._get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _get_schema_version(self) -> int:
+        return self._get_conn().execute("PRAGMA user_version").fetchone()[0]
 
     def _init_db(self):
-        with self._get_conn() as conn:
+        """Create/upgrade the schema in one transaction and stamp SCHEMA_VERSION.
+
+        Skipped entirely on warm starts once the database is at SCHEMA_VERSION.
+        Runs with foreign keys off so tables can be rebuilt in place.
+        """
+        with self._txn() as conn:
             # Legacy tables (kept for migration)
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS cycle_config (
@@ -39,23 +175,8 @@ class Database:
             """)
 
             # New multi-user tables
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    chat_id INTEGER PRIMARY KEY,
-                    added_by INTEGER,
-                    is_admin INTEGER NOT NULL DEFAULT 0,
-                    is_active INTEGER NOT NULL DEFAULT 1,
-                    created_at TEXT NOT NULL DEFAULT (datetime('now'))
-                )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_cycle_config (
-                    chat_id INTEGER PRIMARY KEY,
-                    cycle_length INTEGER NOT NULL DEFAULT 28,
-                    last_period_date TEXT NOT NULL,
-                    FOREIGN KEY (chat_id) REFERENCES users(chat_id)
-                )
-            """)
+            for table, columns in _WITHOUT_ROWID_TABLES.items():
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} {columns} WITHOUT ROWID")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS user_mood_logs (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -74,6 +195,7 @@ class Database:
                     role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
                     content TEXT NOT NULL,
                     created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                    client_msg_id TEXT,
                     FOREIGN KEY (chat_id) REFERENCES users(chat_id)
                 )
             """)
@@ -93,6 +215,10 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_user_mood_logs_chat
                 ON user_mood_logs(chat_id, created_at DESC)
             """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_mood_logs_chat_date
+                ON user_mood_logs(chat_id, date, note, phase)
+            """)
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_chat_history_chat
                 ON chat_history(chat_id, id DESC)
@@ -102,119 +228,157 @@ class Database:
                 ON period_logs(chat_id, period_date DESC)
             """)
 
-    def _migrate_schema(self):
+            self._migrate_schema(conn)
+            # Idempotency key for replayed messages; needs the migrated column
+            conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_history_msg
+                ON chat_history(chat_id, client_msg_id) WHERE client_msg_id IS NOT NULL
+            """)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _migrate_schema(self, conn: sqlite3.Connection):
         """Add columns introduced after initial schema creation."""
-        with self._get_conn() as conn:
-            for col, spec in [
-                ("period_duration", "INTEGER NOT NULL DEFAULT 5"),
-                ("year_of_birth", "INTEGER"),
-            ]:
-                try:
-                    conn.execute(f"ALTER TABLE user_cycle_config ADD COLUMN {col} {spec}")
-                except sqlite3.OperationalError:
-                    pass  # column already exists
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(user_cycle_config)")}
+        for col, spec in [
+            ("period_duration", "INTEGER NOT NULL DEFAULT 5"),
+            ("year_of_birth", "INTEGER"),
+        ]:
+            if col not in existing:
+                conn.execute(f"ALTER TABLE user_cycle_config ADD COLUMN {col} {spec}")
+
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(chat_history)")}
+        if "client_msg_id" not in existing:
+            conn.execute("ALTER TABLE chat_history ADD COLUMN client_msg_id TEXT")
+
+        for table, columns in _WITHOUT_ROWID_TABLES.items():
+            sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()["sql"]
+            if "WITHOUT ROWID" not in sql.upper():
+                self._rebuild_without_rowid(conn, table, columns)
+
+    @staticmethod
+    def _rebuild_without_rowid(conn: sqlite3.Connection, table: str, columns: str):
+        """Copy a rowid table into a WITHOUT ROWID table of the same name."""
+        names = ", ".join(row["name"] for row in conn.execute(f"PRAGMA table_info({table})"))
+        conn.execute(f"CREATE TABLE {table}_new {columns} WITHOUT ROWID")
+        conn.execute(f"INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
 
     # -- Admin bootstrap & legacy migration --
 
     def bootstrap_admin(self, admin_id: int, cycle_length: int, last_period_start: str):
         """Ensure admin exists in users table and migrate legacy data if needed."""
-        with self._get_conn() as conn:
-            row = conn.execute("SELECT 1 FROM users WHERE chat_id = ?", (admin_id,)).fetchone()
-            if not row:
-                conn.execute(
-                    "INSERT INTO users (chat_id, is_admin) VALUES (?, 1)",
-                    (admin_id,),
-                )
-            else:
-                conn.execute(
-                    "UPDATE users SET is_admin = 1, is_active = 1 WHERE chat_id = ?",
-                    (admin_id,),
-                )
+        with self._txn() as conn:
+            conn.execute("""
+                INSERT INTO users (chat_id, is_admin) VALUES (?, 1)
+                ON CONFLICT(chat_id) DO UPDATE SET is_admin = 1, is_active = 1
+            """, (admin_id,))
 
         self._migrate_legacy_data(admin_id, cycle_length, last_period_start)
+        self._state_cache.invalidate(admin_id)
 
     def _migrate_legacy_data(self, admin_id: int, default_cycle_length: int, default_last_period: str):
         """Copy old singleton tables into per-user tables for the admin."""
-        with self._get_conn() as conn:
-            # Migrate cycle_config
-            has_user_config = conn.execute(
-                "SELECT 1 FROM user_cycle_config WHERE chat_id = ?", (admin_id,)
-            ).fetchone()
-            if not has_user_config:
-                legacy = conn.execute("SELECT * FROM cycle_config WHERE id = 1").fetchone()
-                if legacy:
-                    conn.execute(
-                        "INSERT INTO user_cycle_config (chat_id, cycle_length, last_period_date) VALUES (?, ?, ?)",
-                        (admin_id, legacy["cycle_length"], legacy["last_period_date"]),
-                    )
-                else:
-                    conn.execute(
-                        "INSERT INTO user_cycle_config (chat_id, cycle_length, last_period_date) VALUES (?, ?, ?)",
-                        (admin_id, default_cycle_length, default_last_period),
-                    )
-
-            # Migrate mood_logs
-            has_user_logs = conn.execute(
-                "SELECT 1 FROM user_mood_logs WHERE chat_id = ?", (admin_id,)
-            ).fetchone()
-            if not has_user_logs:
-                legacy_logs = conn.execute("SELECT * FROM mood_logs").fetchall()
-                for log in legacy_logs:
-                    conn.execute(
-                        "INSERT INTO user_mood_logs (chat_id, date, note, phase, created_at) VALUES (?, ?, ?, ?, ?)",
-                        (admin_id, log["date"], log["note"], log["phase"], log["created_at"]),
-                    )
+        with self._txn() as conn:
+            # Migrate cycle_config, falling back to the defaults when there is no legacy row
+            conn.execute("""
+                INSERT INTO user_cycle_config (chat_id, cycle_length, last_period_date)
+                SELECT ?, COALESCE(legacy.cycle_length, ?), COALESCE(legacy.last_period_date, ?)
+                FROM (SELECT 1) LEFT JOIN cycle_config AS legacy ON legacy.id = 1
+                WHERE NOT EXISTS (SELECT 1 FROM user_cycle_config WHERE chat_id = ?)
+            """, (admin_id, default_cycle_length, default_last_period, admin_id))
+
+            # Migrate mood_logs in one statement, only if the admin has none yet
+            conn.execute("""
+                INSERT INTO user_mood_logs (chat_id, date, note, phase, created_at)
+                SELECT ?, date, note, phase, created_at FROM mood_logs
+                WHERE NOT EXISTS (SELECT 1 FROM user_mood_logs WHERE chat_id = ?)
+                ORDER BY id
+            """, (admin_id, admin_id))
 
     # -- User management --
 
     def add_user(self, chat_id: int, added_by: int):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute("""
                 INSERT INTO users (chat_id, added_by) VALUES (?, ?)
                 ON CONFLICT(chat_id) DO UPDATE SET is_active = 1, added_by = excluded.added_by
             """, (chat_id, added_by))
+        self._state_cache.invalidate(chat_id)
 
     def remove_user(self, chat_id: int):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute("UPDATE users SET is_active = 0 WHERE chat_id = ?", (chat_id,))
+        self._state_cache.invalidate(chat_id)
 
     def is_user_authorized(self, chat_id: int) -> bool:
-        with self._get_conn() as conn:
-            row = conn.execute(
-                "SELECT 1 FROM users WHERE chat_id = ? AND is_active = 1", (chat_id,)
-            ).fetchone()
-            return row is not None
+        return self.get_user_state(chat_id)["authorized"]
 
     def is_admin(self, chat_id: int) -> bool:
-        with self._get_conn() as conn:
-            row = conn.execute(
-                "SELECT 1 FROM users WHERE chat_id = ? AND is_admin = 1 AND is_active = 1", (chat_id,)
-            ).fetchone()
-            return row is not None
+        return self.get_user_state(chat_id)["is_admin"]
 
-    def get_all_active_users(self) -> list[dict]:
-        with self._get_conn() as conn:
-            rows = conn.execute(
+    def get_all_active_users(self) -> list[sqlite3.Row]:
+        with self._get_read_conn() as conn:
+            return conn.execute(
                 "SELECT chat_id, is_admin FROM users WHERE is_active = 1"
             ).fetchall()
-            return [dict(r) for r in rows]
 
-    def get_all_whitelisted_users(self) -> list[dict]:
-        with self._get_conn() as conn:
-            rows = conn.execute(
+    def get_all_active_users_with_config(self) -> list[sqlite3.Row]:
+        """Active users joined with their cycle config; users without one are left out."""
+        with self._get_read_conn() as conn:
+            return conn.execute("""
+                SELECT c.chat_id, c.cycle_length, c.last_period_date, c.period_duration, c.year_of_birth
+                FROM users AS u JOIN user_cycle_config AS c ON c.chat_id = u.chat_id
+                WHERE u.is_active = 1
+            """).fetchall()
+
+    def get_all_whitelisted_users(self) -> list[sqlite3.Row]:
+        with self._get_read_conn() as conn:
+            return conn.execute(
                 "SELECT chat_id, is_admin, is_active, created_at FROM users ORDER BY created_at"
             ).fetchall()
-            return [dict(r) for r in rows]
 
     # -- Per-user cycle config --
 
     def get_user_config(self, chat_id: int) -> dict | None:
-        with self._get_conn() as conn:
+        with self._get_read_conn() as conn:
             row = conn.execute(
                 "SELECT * FROM user_cycle_config WHERE chat_id = ?", (chat_id,)
             ).fetchone()
             return dict(row) if row else None
 
+    def get_user_state(self, chat_id: int) -> dict:
+        """Authorization, admin flag and cycle config for chat_id, cached.
+
+        Returns {"authorized": bool, "is_admin": bool, "config": dict | None};
+        the dict is shared, treat it as read-only.
+        """
+        return self._state_cache.get(chat_id)
+
+    def _load_user_state(self, chat_id: int) -> dict:
+        """get_user_state's single query."""
+        with self._get_read_conn() as conn:
+            row = conn.execute("""
+                SELECT u.is_admin, c.chat_id AS config_chat_id, c.cycle_length,
+                       c.last_period_date, c.period_duration, c.year_of_birth
+                FROM users AS u LEFT JOIN user_cycle_config AS c ON c.chat_id = u.chat_id
+                WHERE u.chat_id = ? AND u.is_active = 1
+            """, (chat_id,)).fetchone()
+        if row is None:
+            return {"authorized": False, "is_admin": False, "config": None}
+        config = None
+        if row["config_chat_id"] is not None:
+            config = {
+                "chat_id": chat_id,
+                "cycle_length": row["cycle_length"],
+                "last_period_date": row["last_period_date"],
+                "period_duration": row["period_duration"],
+                "year_of_birth": row["year_of_birth"],
+            }
+        return {"authorized": True, "is_admin": bool(row["is_admin"]), "config": config}
+
     def user_has_config(self, chat_id: int) -> bool:
         return self.get_user_config(chat_id) is not None
 
@@ -226,7 +390,7 @@ class Database:
         period_duration: int = 5,
         year_of_birth: int | None = None,
     ):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute("""
                 INSERT INTO user_cycle_config (chat_id, cycle_length, last_period_date, period_duration, year_of_birth)
                 VALUES (?, ?, ?, ?, ?)
@@ -236,46 +400,51 @@ class Database:
                     period_duration = excluded.period_duration,
                     year_of_birth = excluded.year_of_birth
             """, (chat_id, cycle_length, last_period_date, period_duration, year_of_birth))
+        self._state_cache.invalidate(chat_id)
 
     def update_user_cycle_length(self, chat_id: int, cycle_length: int):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute(
                 "UPDATE user_cycle_config SET cycle_length = ? WHERE chat_id = ?",
                 (cycle_length, chat_id),
             )
+        self._state_cache.invalidate(chat_id)
 
     def update_user_last_period_date(self, chat_id: int, last_period_date: str):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute(
                 "UPDATE user_cycle_config SET last_period_date = ? WHERE chat_id = ?",
                 (last_period_date, chat_id),
             )
+        self._state_cache.invalidate(chat_id)
 
     def update_user_period_duration(self, chat_id: int, period_duration: int):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute(
                 "UPDATE user_cycle_config SET period_duration = ? WHERE chat_id = ?",
                 (period_duration, chat_id),
             )
+        self._state_cache.invalidate(chat_id)
 
     def update_user_year_of_birth(self, chat_id: int, year_of_birth: int):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute(
                 "UPDATE user_cycle_config SET year_of_birth = ? WHERE chat_id = ?",
                 (year_of_birth, chat_id),
             )
+        self._state_cache.invalidate(chat_id)
 
     # -- Period history --
 
     def add_period_log(self, chat_id: int, period_date: str):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute(
-                "INSERT INTO period_logs (chat_id, period_date) VALUES (?, ?)",
-                (chat_id, period_date),
+                "INSERT INTO period_logs (chat_id, period_date, created_at) VALUES (?, ?, ?)",
+                (chat_id, period_date, _utc_now()),
             )
 
     def get_period_history(self, chat_id: int, limit: int = 6) -> list[str]:
-        with self._get_conn() as conn:
+        with self._get_read_conn() as conn:
             rows = conn.execute(
                 "SELECT period_date FROM period_logs WHERE chat_id = ? ORDER BY period_date DESC LIMIT ?",
                 (chat_id, limit),
@@ -284,69 +453,196 @@ class Database:
 
     def get_computed_cycle_length(self, chat_id: int) -> int | None:
         """Compute median cycle length from period history. Returns None if < 2 entries."""
-        dates = self.get_period_history(chat_id, limit=7)
-        if len(dates) < 2:
-            return None
-        sorted_dates = sorted(date.fromisoformat(d) for d in dates)
-        gaps = [(sorted_dates[i + 1] - sorted_dates[i]).days for i in range(len(sorted_dates) - 1)]
-        valid_gaps = [g for g in gaps if 18 <= g <= 45]
-        if not valid_gaps:
-            return None
-        return round(statistics.median(valid_gaps))
+        # Gaps between the last 7 period starts, outliers dropped, median taken
+        # from the middle one or two values -- all inside SQLite
+        with self._get_read_conn() as conn:
+            row = conn.execute("""
+                WITH recent AS (
+                    SELECT julianday(period_date) AS jd FROM period_logs
+                    WHERE chat_id = ? ORDER BY period_date DESC LIMIT 7
+                ),
+                valid AS (
+                    SELECT gap FROM (SELECT jd - LAG(jd) OVER (ORDER BY jd) AS gap FROM recent)
+                    WHERE gap BETWEEN 18 AND 45
+                ),
+                n AS (SELECT COUNT(*) AS cnt FROM valid)
+                SELECT AVG(gap) FROM (
+                    SELECT gap FROM valid ORDER BY gap
+                    LIMIT 2 - (SELECT cnt FROM n) % 2 OFFSET ((SELECT cnt FROM n) - 1) / 2
+                )
+            """, (chat_id,)).fetchone()
+        median = row[0]
+        # Python's round() keeps the previous half-to-even behaviour
+        return round(median) if median is not None else None
 
     # -- Per-user mood logs --
 
     def add_user_log(self, chat_id: int, note: str, phase: str, log_date: date | None = None):
         log_date = log_date or date.today()
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute(
-                "INSERT INTO user_mood_logs (chat_id, date, note, phase) VALUES (?, ?, ?, ?)",
-                (chat_id, log_date.isoformat(), note, phase),
+                "INSERT INTO user_mood_logs (chat_id, date, note, phase, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, log_date.isoformat(), note, phase, _utc_now()),
             )
 
-    def get_user_recent_logs(self, chat_id: int, limit: int = 10) -> list[dict]:
-        with self._get_conn() as conn:
-            rows = conn.execute(
-                "SELECT date, note, phase, created_at FROM user_mood_logs WHERE chat_id = ? ORDER BY created_at DESC LIMIT ?",
+    def get_user_recent_logs(self, chat_id: int, limit: int = 10) -> list[sqlite3.Row]:
+        with self._get_read_conn() as conn:
+            return conn.execute(
+                f"SELECT date, note, phase, {_PHASE_LABEL_SQL} AS phase_label, created_at "
+                "FROM user_mood_logs WHERE chat_id = ? ORDER BY created_at DESC LIMIT ?",
                 (chat_id, limit),
             ).fetchall()
-            return [dict(r) for r in rows]
 
-    def get_user_logs_for_date(self, chat_id: int, log_date: date) -> list[dict]:
-        with self._get_conn() as conn:
-            rows = conn.execute(
+    def get_user_recent_logs_minimal(self, chat_id: int, limit: int = 3) -> list[sqlite3.Row]:
+        """Recent logs with only the date and note columns, for building AI prompts."""
+        with self._get_read_conn() as conn:
+            return conn.execute(_RECENT_LOGS_MINIMAL_SQL, (chat_id, limit)).fetchall()
+
+    def get_user_logs_for_date(self, chat_id: int, log_date: date) -> list[sqlite3.Row]:
+        with self._get_read_conn() as conn:
+            return conn.execute(
                 "SELECT date, note, phase FROM user_mood_logs WHERE chat_id = ? AND date = ?",
                 (chat_id, log_date.isoformat()),
             ).fetchall()
-            return [dict(r) for r in rows]
 
     # -- Chat history --
 
-    def add_chat_message(self, chat_id: int, role: str, content: str):
-        with self._get_conn() as conn:
-            conn.execute(
-                "INSERT INTO chat_history (chat_id, role, content) VALUES (?, ?, ?)",
-                (chat_id, role, content),
-            )
+    def add_chat_message(self, chat_id: int, role: str, content: str, client_msg_id: str | None = None):
+        """Store a chat message; a repeated client_msg_id for the same chat is ignored."""
+        with self._txn() as conn:
+            conn.execute("""
+                INSERT INTO chat_history (chat_id, role, content, created_at, client_msg_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, client_msg_id) WHERE client_msg_id IS NOT NULL DO NOTHING
+            """, (chat_id, role, content, _utc_now(), client_msg_id))
+
+    def add_chat_messages(self, chat_id: int, messages: list[tuple[str, str]]):
+        """Insert several (role, content) messages in one transaction."""
+        self.add_chat_rows([(chat_id, role, content, None) for role, content in messages])
+
+    def add_chat_rows(self, rows: list[tuple[int, str, str, str | None]]):
+        """Insert (chat_id, role, content, client_msg_id) rows, possibly for several chats, in one transaction."""
+        created_at = _utc_now()
+        with self._txn() as conn:
+            conn.executemany("""
+                INSERT INTO chat_history (chat_id, role, content, created_at, client_msg_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, client_msg_id) WHERE client_msg_id IS NOT NULL DO NOTHING
+            """, [(chat_id, role, content, created_at, msg_id) for chat_id, role, content, msg_id in rows])
 
     def get_chat_history(self, chat_id: int, limit: int = 20) -> list[dict]:
-        with self._get_conn() as conn:
-            rows = conn.execute(
-                "SELECT role, content FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
-                (chat_id, limit),
-            ).fetchall()
-            return [dict(r) for r in reversed(rows)]
+        with self._get_read_conn() as conn:
+            rows = conn.execute(_CHAT_HISTORY_SQL, (chat_id, limit)).fetchall()
+            return [{"role": r[0], "content": r[1]} for r in rows]
+
+    def get_chat_bundle(self, chat_id: int, history_limit: int = 20, logs_limit: int = 3) -> ChatBundle:
+        """Recent logs and chat history for one AI chat turn, read from a single snapshot."""
+        conn = self._get_read_conn()
+        conn.execute("BEGIN")
+        try:
+            recent_logs = conn.execute(_RECENT_LOGS_MINIMAL_SQL, (chat_id, logs_limit)).fetchall()
+            rows = conn.execute(_CHAT_HISTORY_SQL, (chat_id, history_limit)).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return ChatBundle(recent_logs, [{"role": r[0], "content": r[1]} for r in rows])
 
     def prune_chat_history(self, chat_id: int, keep: int = 50):
         """Remove old chat messages beyond the keep limit."""
-        with self._get_conn() as conn:
+        if keep <= 0:
+            self.clear_chat_history(chat_id)
+            return
+        # The oldest id worth keeping is found with one index seek; everything
+        # older is deleted by range instead of a NOT IN (subquery) scan
+        with self._txn() as conn:
             conn.execute("""
-                DELETE FROM chat_history WHERE chat_id = ? AND id NOT IN (
+                DELETE FROM chat_history WHERE chat_id = ? AND id < (
                     SELECT id FROM chat_history WHERE chat_id = ?
-                    ORDER BY id DESC LIMIT ?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?
                 )
-            """, (chat_id, chat_id, keep))
+            """, (chat_id, chat_id, keep - 1))
 
     def clear_chat_history(self, chat_id: int):
-        with self._get_conn() as conn:
+        with self._txn() as conn:
             conn.execute("DELETE FROM chat_history WHERE chat_id = ?", (chat_id,))
+
+
+class ChatHistoryWriter:
+    """Coalesces chat_history inserts from the event loop into batched transactions.
+
+    Messages queued within `flush_interval` seconds of the first one (up to
+    `batch_size`) are written with a single executemany. Rows queued together
+    with put_many always land in the same batch. put and put_many return a
+    future that resolves once the batch holding the rows has committed.
+    """
+
+    def __init__(self, db: Database, batch_size: int = 64, flush_interval: float = 0.05):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: asyncio.Queue[tuple[list[tuple[int, str, str, str | None]], asyncio.Future]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, chat_id: int, role: str, content: str, client_msg_id: str | None = None) -> asyncio.Future:
+        return self.put_many([(chat_id, role, content, client_msg_id)])
+
+    def put_many(self, rows: list[tuple[int, str, str, str | None]]) -> asyncio.Future:
+        """Queue (chat_id, role, content, client_msg_id) rows to be committed together.
+
+        Await the returned future to wait for the commit; it carries the
+        exception if the batch failed.
+        """
+        done = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, done))
+        return done
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rows, done = await self._queue.get()
+            batch = list(rows)
+            waiters = [done]
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    rows, done = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.extend(rows)
+                waiters.append(done)
+            error = None
+            try:
+                # Commit on a worker thread (thread-local connection) so the
+                # BEGIN IMMEDIATE / executemany / COMMIT never blocks the loop
+                await asyncio.to_thread(self._db.add_chat_rows, batch)
+            except Exception as e:
+                logger.error("Failed to write %d chat messages: %s", len(batch), e)
+                error = e
+            except asyncio.CancelledError:
+                for done in waiters:
+                    done.cancel()
+                raise
+            finally:
+                for done in waiters:
+                    # A waiter may have been cancelled while the batch was in flight
+                    if not done.done():
+                        if error is None:
+                            done.set_result(None)
+                        else:
+                            done.set_exception(error)
+                    self._queue.task_done()
+
+    async def aclose(self):
+        """Flush everything queued so far and stop the writer task."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
@@ -1,60 +1,78 @@
+import asyncio
 import functools
+import html
 import logging
-import time
-from collections import defaultdict
+import weakref
 from datetime import date, datetime
+from typing import NamedTuple
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, constants
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
 from config.settings import MAX_CHAT_HISTORY, VERSION
 from src.ai import generate_tip, generate_chat_response
 from src.cycle import (
     get_cycle_day,
-    get_phase,
     get_phase_info,
     get_phase_detail,
     predict_dates,
     days_until,
-    PHASE_LABELS,
     PHASE_DESCRIPTIONS,
 )
 from src.db import Database
+from src.ratelimit import check_ai_rate_limit
+
+logger = logging.getLogger(__name__)
+
+# Arguments are small ints (and dates for predictions), so after warm-up every
+# call is a cache hit. Returned dicts are shared: treat them as read-only.
+_phase_info = functools.lru_cache(maxsize=2048)(get_phase_info)
+_predict_dates = functools.lru_cache(maxsize=1024)(predict_dates)
 
 MAX_NOTE_LENGTH = 500
 MAX_CHAT_MESSAGE_LENGTH = 2000
-AI_RATE_LIMIT = 5
-AI_RATE_WINDOW = 60.0
-_ai_call_timestamps: dict[int, list[float]] = defaultdict(list)
+# One lock per chat serializes its AI calls; entries vanish once no handler holds them
+_ai_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
 
 MIN_PERIOD_DURATION = 2
 MAX_PERIOD_DURATION = 7
 
 
-def _check_ai_rate_limit(chat_id: int) -> bool:
-    """Return True if the user is within rate limits."""
-    now = time.monotonic()
-    timestamps = _ai_call_timestamps[chat_id]
-    _ai_call_timestamps[chat_id] = [t for t in timestamps if now - t < AI_RATE_WINDOW]
-    if len(_ai_call_timestamps[chat_id]) >= AI_RATE_LIMIT:
-        return False
-    _ai_call_timestamps[chat_id].append(now)
-    return True
+async def _settle(task: asyncio.Task) -> None:
+    """Wait for a fire-and-forget placeholder; a failed placeholder isn't worth surfacing."""
+    try:
+        await task
+    except TelegramError as e:
+        logger.warning("Placeholder message failed: %s", e)
+
 
+def _lock_for(chat_id: int) -> asyncio.Lock:
+    lock = _ai_locks.get(chat_id)
+    if lock is None:
+        lock = _ai_locks[chat_id] = asyncio.Lock()
+    return lock
 
-def _escape_markdown(text: str) -> str:
-    """Escape Markdown V1 special characters in user-generated text."""
-    for char in ('*', '_', '`', '['):
-        text = text.replace(char, '\\' + char)
-    return text
 
 MIN_CYCLE_LENGTH = 20
 MAX_CYCLE_LENGTH = 45
 
-logger = logging.getLogger(__name__)
 
+class _StaticKeyboard(InlineKeyboardMarkup):
+    """Module-level keyboard serialized once; PTB calls to_dict on every send."""
 
-MAIN_KEYBOARD = InlineKeyboardMarkup([
+    __slots__ = ("_serialized",)
+
+    def __init__(self, inline_keyboard):
+        super().__init__(inline_keyboard)
+        with self._unfrozen():
+            self._serialized = super().to_dict()
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        return self._serialized if recursive else super().to_dict(recursive)
+
+
+MAIN_KEYBOARD = _StaticKeyboard([
     [
         InlineKeyboardButton("\U0001f4ca Status", callback_data="status"),
         InlineKeyboardButton("\U0001f4a1 Tip", callback_data="tip"),
@@ -73,18 +91,15 @@ MAIN_KEYBOARD = InlineKeyboardMarkup([
     ],
 ])
 
-BACK_KEYBOARD = InlineKeyboardMarkup([
-    [InlineKeyboardButton("\U0001f519 Back to Menu", callback_data="menu")],
-])
+# Buttons are immutable in PTB, so identical ones are shared between keyboards
+_BACK_BUTTON = InlineKeyboardButton("\U0001f519 Back to Menu", callback_data="menu")
+_TIP_BUTTON = InlineKeyboardButton("\U0001f4a1 Another Tip", callback_data="tip")
 
-TIP_AGAIN_KEYBOARD = InlineKeyboardMarkup([
-    [
-        InlineKeyboardButton("\U0001f4a1 Another Tip", callback_data="tip"),
-        InlineKeyboardButton("\U0001f519 Back to Menu", callback_data="menu"),
-    ],
-])
+BACK_KEYBOARD = _StaticKeyboard([[_BACK_BUTTON]])
+
+TIP_AGAIN_KEYBOARD = _StaticKeyboard([[_TIP_BUTTON, _BACK_BUTTON]])
 
-PERIOD_CONFIRM_KEYBOARD = InlineKeyboardMarkup([
+PERIOD_CONFIRM_KEYBOARD = _StaticKeyboard([
     [
         InlineKeyboardButton("\u2705 Yes, Today!", callback_data="period_confirm"),
         InlineKeyboardButton("\U0001f519 Cancel", callback_data="menu"),
@@ -92,6 +107,99 @@ PERIOD_CONFIRM_KEYBOARD = InlineKeyboardMarkup([
 ])
 
 
+# Message templates, built once and filled with str.format_map per call
+START_TEMPLATE = (
+    "Hey darling! \U0001f319\n\n"
+    "I'm <b>Lunaris</b>, your cycle companion.\n"
+    "I promise not to be annoying \u2014 just here to look out for you \U0001f49b\n\n"
+    "\U0001f4c5 Today is day <b>{cycle_day}</b> of your cycle\n"
+    "Phase: <b>{label}</b>\n"
+    "{description}\n\n"
+    "Pick something from below, or use commands anytime!"
+)
+
+MENU_TEMPLATE = (
+    "\U0001f319 <b>Lunaris \u2014 Main Menu</b>\n\n"
+    "\U0001f4c5 Day <b>{cycle_day}</b> \u2014 {label}\n"
+    "{description}\n\n"
+    "What would you like to do, darling?"
+)
+
+STATUS_TEMPLATE = (
+    "\U0001f4ca <b>Your Status, Darling</b>\n\n"
+    "\U0001f4c5 Cycle day: <b>{cycle_day}</b> of {cycle_length}\n"
+    "Phase: <b>{label}</b>\n\n"
+    "{description}"
+)
+
+NEXT_TEMPLATE = (
+    "\U0001f52e <b>Upcoming Dates, Darling</b>\n\n"
+    "\U0001fa78 Next period: <b>{next_period}</b> ({days_to_period} days)\n"
+    "\u26a1 Next PMS: <b>{next_pms}</b> ({days_to_pms} days)\n"
+    "\u2728 Next ovulation: <b>{next_ovulation}</b> ({days_to_ovulation} days)"
+)
+
+SETUP_DONE_TEMPLATE = (
+    "\u2705 All set, darling!\n\n"
+    "\U0001f4cf Cycle length: <b>{cycle_length}</b> days\n"
+    "\U0001f4c5 Last period: <b>{last_period}</b>\n"
+    "\U0001fa78 Period duration: <b>{period_duration}</b> days\n"
+    "{age_line}"
+    "\U0001f4c5 Today is day <b>{cycle_day}</b> \u2014 {label}\n"
+    "\nYou're all good to go! Use /start to see the main menu \U0001f49b"
+)
+SETUP_AGE_LINE = "\U0001f382 Age: ~<b>{age}</b> years old\n"
+
+HISTORY_HEADER = "\U0001f4cb <b>Recent Notes, Darling:</b>\n"
+
+SETTINGS_TEMPLATE = (
+    "\u2699\ufe0f <b>Settings, Darling</b>\n\n"
+    "\U0001f4cf Cycle length: <b>{cycle_length}</b> days\n"
+    "\U0001f4c5 Last period start: <b>{last_period_date}</b>\n"
+    "\U0001fa78 Period duration: <b>{period_duration}</b> days"
+)
+SETTINGS_AGE_TEMPLATE = "\n\U0001f382 Birth year: <b>{year_of_birth}</b> (~{age} years old)"
+SETTINGS_HELP = (
+    "\n\nTo change cycle length:\n<code>/settings 30</code>\n"
+    "To change period duration:\n<code>/settings period 4</code>\n"
+    "To set birth year:\n<code>/settings age 1995</code>\n"
+    "To change period date:\n<code>/adjust 2026-02-25</code>"
+)
+
+CHAT_INTRO_TEXT = (
+    "\U0001f4ac <b>Chat with Lunaris</b>\n\n"
+    "Just type anything, darling! No commands needed.\n"
+    "Ask me about your cycle, symptoms, nutrition, exercise, "
+    "hormones, sleep, skin \u2014 anything women's health related \U0001f49b\n\n"
+    "I'll remember our conversation, and you can clear it anytime with /clearchat"
+)
+
+PERIOD_CONFIRM_TEXT = (
+    "\U0001fa78 <b>Period started today, darling?</b>\n\n"
+    "I'll reset your cycle and update your cycle length.\n"
+    "If it started on a different day, use:\n<code>/period 2026-02-25</code>"
+)
+
+# reply_text kwargs for the denial paths, built once instead of per rejected update
+_DENIED_REPLY = {"text": "Sorry darling, this bot isn't for you \U0001f494"}
+_NEEDS_SETUP_REPLY = {
+    "text": (
+        "You need to set up your cycle first, darling!\n"
+        "Use: <code>/setup &lt;cycle_length&gt; &lt;last_period_date&gt;</code>\n"
+        "Example: <code>/setup 28 2026-02-15</code>"
+    ),
+    "parse_mode": constants.ParseMode.HTML,
+}
+_ADMIN_ONLY_REPLY = {"text": "This command is admin-only, darling \U0001f512"}
+
+# /setup replies for an argument that doesn't parse, keyed by argument name (HTML)
+_SETUP_PARSE_ERRORS = {
+    "cycle_length": "Cycle length must be a number, darling.",
+    "last_period": "Wrong date format darling. Use YYYY-MM-DD, like <code>2026-02-15</code>",
+    "period_duration": "Period duration must be a number, darling.",
+    "year_of_birth": "Birth year must be a number, darling.",
+}
+
 # -- Auth decorators (3 tiers) --
 
 def whitelisted(func):
@@ -102,7 +210,7 @@ def whitelisted(func):
         db = get_db(context)
         if not db.is_user_authorized(chat_id):
             if update.message:
-                await update.message.reply_text("Sorry darling, this bot isn't for you \U0001f494")
+                await update.message.reply_text(**_DENIED_REPLY)
             return
         return await func(update, context)
     return wrapper
@@ -112,20 +220,14 @@ def authorized(func):
     """Decorator: whitelisted + has completed setup (has cycle config)."""
     @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        chat_id = update.effective_chat.id
-        db = get_db(context)
-        if not db.is_user_authorized(chat_id):
+        state = _load_user_state(context, update.effective_chat.id)
+        if not state["authorized"]:
             if update.message:
-                await update.message.reply_text("Sorry darling, this bot isn't for you \U0001f494")
+                await update.message.reply_text(**_DENIED_REPLY)
             return
-        if not db.user_has_config(chat_id):
+        if state["config"] is None:
             if update.message:
-                await update.message.reply_text(
-                    "You need to set up your cycle first, darling!\n"
-                    "Use: `/setup <cycle_length> <last_period_date>`\n"
-                    "Example: `/setup 28 2026-02-15`",
-                    parse_mode="Markdown",
-                )
+                await update.message.reply_text(**_NEEDS_SETUP_REPLY)
             return
         return await func(update, context)
     return wrapper
@@ -135,12 +237,11 @@ def authorized_callback(func):
     """Decorator for callback query handlers — whitelisted + setup done."""
     @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        chat_id = update.effective_chat.id
-        db = get_db(context)
-        if not db.is_user_authorized(chat_id):
+        state = _load_user_state(context, update.effective_chat.id)
+        if not state["authorized"]:
             await update.callback_query.answer("Not authorized")
             return
-        if not db.user_has_config(chat_id):
+        if state["config"] is None:
             await update.callback_query.answer("Please run /setup first")
             return
         return await func(update, context)
@@ -155,7 +256,7 @@ def admin_only(func):
         db = get_db(context)
         if not db.is_admin(chat_id):
             if update.message:
-                await update.message.reply_text("This command is admin-only, darling \U0001f512")
+                await update.message.reply_text(**_ADMIN_ONLY_REPLY)
             return
         return await func(update, context)
     return wrapper
@@ -167,23 +268,115 @@ def get_db(context: ContextTypes.DEFAULT_TYPE) -> Database:
     return context.bot_data["db"]
 
 
-def get_cycle_info(db: Database, chat_id: int) -> tuple[date, int, int]:
-    """Get last_period_start, cycle_length, and period_duration from DB."""
-    config = db.get_user_config(chat_id)
+def _parse_cycle_config(config: dict) -> tuple[date, int, int]:
+    """last_period_start, cycle_length, and period_duration from a config row."""
     last_period = date.fromisoformat(config["last_period_date"])
     cycle_length = config["cycle_length"]
     period_duration = config.get("period_duration", 5) or 5
     return last_period, cycle_length, period_duration
 
 
+def _cycle_info(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> tuple[date, int, int]:
+    """Parsed cycle config, memoized against the Database's cached config row:
+    a write or TTL expiry there yields a new row and so a reparse here."""
+    config = _user_config(context, chat_id)
+    cached = context.user_data.get("_cycle")
+    if cached is None or cached[0] is not config:
+        cached = context.user_data["_cycle"] = (config, _parse_cycle_config(config))
+    return cached[1]
+
+
+async def prepare_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs before the handlers (group -1): pin today's date for this update."""
+    if context.chat_data is not None:
+        context.chat_data["_today"] = date.today()
+
+
+def _today(context: ContextTypes.DEFAULT_TYPE) -> date:
+    """Date pinned by prepare_update, so one update never straddles midnight."""
+    today = context.chat_data.get("_today") if context.chat_data is not None else None
+    return today if today is not None else date.today()
+
+
+class _CycleView(NamedTuple):
+    today: date
+    last_period: date
+    cycle_length: int
+    period_duration: int
+    cycle_day: int
+    info: dict
+
+
+def _current_view(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> _CycleView:
+    """Today's cycle day and phase info, recomputed when the day or the cycle config changes."""
+    today = _today(context)
+    cycle = _cycle_info(context, chat_id)
+    view = context.user_data.get("_view")
+    if view is None or view.today != today or (view.last_period, view.cycle_length, view.period_duration) != cycle:
+        last_period, cycle_length, period_duration = cycle
+        cycle_day = get_cycle_day(last_period, today, cycle_length)
+        info = _phase_info(cycle_day, cycle_length, period_duration)
+        view = context.user_data["_view"] = _CycleView(
+            today, last_period, cycle_length, period_duration, cycle_day, info
+        )
+    return view
+
+
+def _load_user_state(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> dict:
+    """Auth + config for chat_id from the Database's cache (one query on a miss)."""
+    return get_db(context).get_user_state(chat_id)
+
+
+def _user_config(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> dict | None:
+    return _load_user_state(context, chat_id)["config"]
+
+
+def _render_next(predictions: dict, today: date) -> str:
+    return NEXT_TEMPLATE.format_map({
+        **predictions,
+        "days_to_period": days_until(predictions["next_period"], today),
+        "days_to_pms": days_until(predictions["next_pms"], today),
+        "days_to_ovulation": days_until(predictions["next_ovulation"], today),
+    })
+
+
+def _render_history(logs) -> str:
+    return "\n".join([
+        HISTORY_HEADER,
+        *(
+            f"\U0001f4c5 {log['date']} \u2014 {log['phase_label']}\n"
+            f"\U0001f4dd {html.escape(log['note'], quote=False)}\n"
+            for log in logs
+        ),
+    ])
+
+
+def _render_user_row(user) -> str:
+    status = "\u2705" if user["is_active"] else "\u274c"
+    role = " (admin)" if user["is_admin"] else ""
+    return f"{status} <code>{user['chat_id']}</code>{role}"
+
+
+def _render_settings(config, today: date) -> str:
+    text = SETTINGS_TEMPLATE.format_map({
+        "cycle_length": config["cycle_length"],
+        "last_period_date": config["last_period_date"],
+        "period_duration": config.get("period_duration", 5) or 5,
+    })
+    yob = config.get("year_of_birth")
+    if yob:
+        text += SETTINGS_AGE_TEMPLATE.format_map({"year_of_birth": yob, "age": today.year - yob})
+    return text + SETTINGS_HELP
+
+
 # -- Admin commands --
 
 @admin_only
 async def adduser_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
-            "Usage: `/adduser <telegram_user_id>`",
-            parse_mode="Markdown",
+            "Usage: <code>/adduser &lt;telegram_user_id&gt;</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
     try:
@@ -194,15 +387,15 @@ async def adduser_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     db = get_db(context)
     db.add_user(new_user_id, added_by=update.effective_chat.id)
-    await update.message.reply_text(f"\u2705 User `{new_user_id}` has been whitelisted!", parse_mode="Markdown")
+    await update.message.reply_text(f"\u2705 User <code>{new_user_id}</code> has been whitelisted!", parse_mode=constants.ParseMode.HTML)
 
 
 @admin_only
 async def removeuser_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
-            "Usage: `/removeuser <telegram_user_id>`",
-            parse_mode="Markdown",
+            "Usage: <code>/removeuser &lt;telegram_user_id&gt;</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
     try:
@@ -216,7 +409,7 @@ async def removeuser_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Can't remove an admin, darling \U0001f512")
         return
     db.remove_user(target_id)
-    await update.message.reply_text(f"\u2705 User `{target_id}` has been removed.", parse_mode="Markdown")
+    await update.message.reply_text(f"\u2705 User <code>{target_id}</code> has been removed.", parse_mode=constants.ParseMode.HTML)
 
 
 @admin_only
@@ -227,13 +420,8 @@ async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("No users in the whitelist.")
         return
 
-    lines = ["\U0001f465 *Whitelisted Users:*\n"]
-    for u in users:
-        status = "\u2705" if u["is_active"] else "\u274c"
-        role = " (admin)" if u["is_admin"] else ""
-        lines.append(f"{status} `{u['chat_id']}`{role}")
-
-    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+    text = "\n".join(["\U0001f465 <b>Whitelisted Users:</b>\n", *map(_render_user_row, users)])
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML)
 
 
 # -- Setup command (whitelisted users who haven't configured yet) --
@@ -243,87 +431,70 @@ async def setup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
             "Set up your cycle, darling!\n"
-            "Usage: `/setup <cycle_length> <last_period_date> [period_duration] [birth_year]`\n"
-            "Example: `/setup 28 2026-02-15`\n"
-            "Or: `/setup 28 2026-02-15 5 1995`",
-            parse_mode="Markdown",
+            "Usage: <code>/setup &lt;cycle_length&gt; &lt;last_period_date&gt; [period_duration] [birth_year]</code>\n"
+            "Example: <code>/setup 28 2026-02-15</code>\n"
+            "Or: <code>/setup 28 2026-02-15 5 1995</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
 
+    args = context.args
+    today = _today(context)
+    period_duration = 5
+    year_of_birth = None
+    # One handler for every argument; `field` records which one was being parsed
+    field = "cycle_length"
     try:
-        cycle_length = int(context.args[0])
+        cycle_length = int(args[0])
         if not MIN_CYCLE_LENGTH <= cycle_length <= MAX_CYCLE_LENGTH:
             await update.message.reply_text(f"Cycle length should be between {MIN_CYCLE_LENGTH} and {MAX_CYCLE_LENGTH} days, darling.")
             return
-    except ValueError:
-        await update.message.reply_text("Cycle length must be a number, darling.")
-        return
-
-    try:
-        last_period = date.fromisoformat(context.args[1])
-    except ValueError:
-        await update.message.reply_text(
-            "Wrong date format darling. Use YYYY-MM-DD, like `2026-02-15`",
-            parse_mode="Markdown",
-        )
-        return
 
-    if last_period > date.today():
-        await update.message.reply_text("That date is in the future, darling! Use a past or today's date.")
-        return
+        field = "last_period"
+        last_period = date.fromisoformat(args[1])
+        if last_period > today:
+            await update.message.reply_text("That date is in the future, darling! Use a past or today's date.")
+            return
 
-    # Optional: period duration
-    period_duration = 5
-    if len(context.args) >= 3:
-        try:
-            period_duration = int(context.args[2])
+        # Optional: period duration
+        if len(args) >= 3:
+            field = "period_duration"
+            period_duration = int(args[2])
             if not MIN_PERIOD_DURATION <= period_duration <= MAX_PERIOD_DURATION:
                 await update.message.reply_text(
                     f"Period duration should be between {MIN_PERIOD_DURATION} and {MAX_PERIOD_DURATION} days, darling."
                 )
                 return
-        except ValueError:
-            await update.message.reply_text("Period duration must be a number, darling.")
-            return
 
-    # Optional: birth year
-    year_of_birth = None
-    if len(context.args) >= 4:
-        try:
-            year_of_birth = int(context.args[3])
-            current_year = date.today().year
-            if not 1940 <= year_of_birth <= current_year - 10:
+        # Optional: birth year
+        if len(args) >= 4:
+            field = "year_of_birth"
+            year_of_birth = int(args[3])
+            if not 1940 <= year_of_birth <= today.year - 10:
                 await update.message.reply_text(
-                    f"Birth year should be between 1940 and {current_year - 10}, darling."
+                    f"Birth year should be between 1940 and {today.year - 10}, darling."
                 )
                 return
-        except ValueError:
-            await update.message.reply_text("Birth year must be a number, darling.")
-            return
+    except ValueError:
+        await update.message.reply_text(_SETUP_PARSE_ERRORS[field], parse_mode=constants.ParseMode.HTML)
+        return
 
     chat_id = update.effective_chat.id
     db = get_db(context)
     db.upsert_user_config(chat_id, cycle_length, last_period.isoformat(), period_duration, year_of_birth)
 
-    cycle_day = get_cycle_day(last_period, date.today(), cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
+    cycle_day = get_cycle_day(last_period, today, cycle_length)
+    info = _phase_info(cycle_day, cycle_length, period_duration)
 
-    lines = [
-        f"\u2705 All set, darling!\n",
-        f"\U0001f4cf Cycle length: *{cycle_length}* days",
-        f"\U0001f4c5 Last period: *{last_period}*",
-        f"\U0001fa78 Period duration: *{period_duration}* days",
-    ]
-    if year_of_birth:
-        age = date.today().year - year_of_birth
-        lines.append(f"\U0001f382 Age: ~*{age}* years old")
-    lines.append(f"\U0001f4c5 Today is day *{cycle_day}* \u2014 {info['label']}")
-    lines.append(f"\nYou're all good to go! Use /start to see the main menu \U0001f49b")
-
-    await update.message.reply_text(
-        "\n".join(lines),
-        parse_mode="Markdown",
-    )
+    text = SETUP_DONE_TEMPLATE.format_map({
+        "cycle_length": cycle_length,
+        "last_period": last_period,
+        "period_duration": period_duration,
+        "age_line": SETUP_AGE_LINE.format(age=today.year - year_of_birth) if year_of_birth else "",
+        "cycle_day": cycle_day,
+        "label": info["label"],
+    })
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML)
 
 
 # -- Clear chat command --
@@ -341,34 +512,21 @@ async def clearchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @whitelisted
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    db = get_db(context)
 
-    if not db.user_has_config(chat_id):
+    # One query; the config it returns also feeds _current_view below
+    if _load_user_state(context, chat_id)["config"] is None:
         await update.message.reply_text(
             "Hey darling! \U0001f319\n\n"
-            "I'm *Lunaris*, your cycle companion.\n"
+            "I'm <b>Lunaris</b>, your cycle companion.\n"
             "Let's get you set up first!\n\n"
-            "Use: `/setup <cycle_length> <last_period_date>`\n"
-            "Example: `/setup 28 2026-02-15`",
-            parse_mode="Markdown",
+            "Use: <code>/setup &lt;cycle_length&gt; &lt;last_period_date&gt;</code>\n"
+            "Example: <code>/setup 28 2026-02-15</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
 
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
-
-    text = (
-        f"Hey darling! \U0001f319\n\n"
-        f"I'm *Lunaris*, your cycle companion.\n"
-        f"I promise not to be annoying \u2014 just here to look out for you \U0001f49b\n\n"
-        f"\U0001f4c5 Today is day *{info['cycle_day']}* of your cycle\n"
-        f"Phase: *{info['label']}*\n"
-        f"{info['description']}\n\n"
-        f"Pick something from below, or use commands anytime!"
-    )
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    text = START_TEMPLATE.format_map(_current_view(context, chat_id).info)
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 @authorized_callback
@@ -376,122 +534,83 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all inline keyboard button presses."""
     query = update.callback_query
     await query.answer()
-    data = query.data
-
-    if data == "menu":
-        await _show_menu(query, context)
-    elif data == "status":
-        await _show_status(query, context)
-    elif data == "tip":
-        await _show_tip(query, context)
-    elif data == "next":
-        await _show_next(query, context)
-    elif data == "phase":
-        await _show_phase(query, context)
-    elif data == "history":
-        await _show_history(query, context)
-    elif data == "settings":
-        await _show_settings(query, context)
-    elif data == "period":
-        await _show_period_confirm(query, context)
-    elif data == "period_confirm":
-        await _do_period_today(query, context)
-    elif data == "chat":
-        await _show_chat_intro(query, context)
+    handler = _CALLBACK_DISPATCH.get(query.data)
+    if handler:
+        await handler(query, context)
 
 
 async def _show_menu(query, context):
     chat_id = query.message.chat_id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
+    view = _current_view(context, chat_id)
+    info = view.info
 
-    text = (
-        f"\U0001f319 *Lunaris \u2014 Main Menu*\n\n"
-        f"\U0001f4c5 Day *{info['cycle_day']}* \u2014 {info['label']}\n"
-        f"{info['description']}\n\n"
-        f"What would you like to do, darling?"
-    )
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    text = MENU_TEMPLATE.format_map(info)
+    await query.edit_message_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 async def _show_status(query, context):
     chat_id = query.message.chat_id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
+    view = _current_view(context, chat_id)
+    info = view.info
 
-    text = (
-        f"\U0001f4ca *Your Status, Darling*\n\n"
-        f"\U0001f4c5 Cycle day: *{info['cycle_day']}* of {cycle_length}\n"
-        f"Phase: *{info['label']}*\n\n"
-        f"{info['description']}"
-    )
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    text = STATUS_TEMPLATE.format_map({**info, "cycle_length": view.cycle_length})
+    await query.edit_message_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 async def _show_tip(query, context):
     chat_id = query.message.chat_id
-    if not _check_ai_rate_limit(chat_id):
+    if not check_ai_rate_limit(chat_id):
         await query.edit_message_text(
             "Easy there darling, let me catch my breath! Try again in a minute \U0001f49b",
             reply_markup=BACK_KEYBOARD,
         )
         return
     db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    phase = get_phase(cycle_day, cycle_length, period_duration)
-    recent_logs = db.get_user_recent_logs(chat_id, 3)
-
-    await query.edit_message_text("Hold on darling, thinking of something good for you... \U0001f914")
+    view = _current_view(context, chat_id)
+    cycle_day, phase = view.cycle_day, view.info["phase"]
 
-    try:
-        tip = await generate_tip(phase, cycle_day, recent_logs, model="claude-sonnet-4-6")
-        await query.edit_message_text(
-            f"\U0001f4a1 *Tip for You, Darling:*\n\n{tip}",
-            parse_mode="Markdown",
-            reply_markup=TIP_AGAIN_KEYBOARD,
-        )
-    except Exception as e:
-        logger.error(f"AI tip generation failed: {e}")
-        await query.edit_message_text(
-            "Oops, my brain froze darling \U0001f605 Try again in a sec!",
-            reply_markup=BACK_KEYBOARD,
+    async with _lock_for(chat_id):
+        # Placeholder goes out while the tip is generated instead of before it
+        placeholder = asyncio.create_task(
+            query.edit_message_text("Hold on darling, thinking of something good for you... \U0001f914")
         )
 
+        try:
+            # Read recent logs on a worker thread while the placeholder is sent
+            recent_logs = await asyncio.to_thread(db.get_user_recent_logs_minimal, chat_id, 3)
+            tip = await generate_tip(phase, cycle_day, recent_logs, model="claude-sonnet-4-6")
+            await _settle(placeholder)
+            await query.edit_message_text(
+                f"\U0001f4a1 <b>Tip for You, Darling:</b>\n\n{html.escape(tip, quote=False)}",
+                parse_mode=constants.ParseMode.HTML,
+                reply_markup=TIP_AGAIN_KEYBOARD,
+            )
+        except Exception as e:
+            logger.error("AI tip generation failed: %s", e)
+            await _settle(placeholder)
+            await query.edit_message_text(
+                "Oops, my brain froze darling \U0001f605 Try again in a sec!",
+                reply_markup=BACK_KEYBOARD,
+            )
+
 
 async def _show_next(query, context):
     chat_id = query.message.chat_id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    predictions = predict_dates(last_period, cycle_length)
-    today = date.today()
+    last_period, cycle_length, period_duration = _cycle_info(context, chat_id)
+    today = _today(context)
+    predictions = _predict_dates(last_period, cycle_length, today)
 
-    text = (
-        f"\U0001f52e *Upcoming Dates, Darling*\n\n"
-        f"\U0001fa78 Next period: *{predictions['next_period']}* ({days_until(predictions['next_period'], today)} days)\n"
-        f"\u26a1 Next PMS: *{predictions['next_pms']}* ({days_until(predictions['next_pms'], today)} days)\n"
-        f"\u2728 Next ovulation: *{predictions['next_ovulation']}* ({days_until(predictions['next_ovulation'], today)} days)"
-    )
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    text = _render_next(predictions, today)
+    await query.edit_message_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 async def _show_phase(query, context):
     chat_id = query.message.chat_id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
+    view = _current_view(context, chat_id)
+    info = view.info
 
-    text = get_phase_detail(info["phase"], cycle_length, period_duration)
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    text = get_phase_detail(info["phase"], view.cycle_length, view.period_duration)
+    await query.edit_message_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 async def _show_history(query, context):
@@ -506,98 +625,82 @@ async def _show_history(query, context):
         )
         return
 
-    lines = ["\U0001f4cb *Recent Notes, Darling:*\n"]
-    for log in logs:
-        phase_label = PHASE_LABELS.get(log["phase"], log["phase"])
-        lines.append(f"\U0001f4c5 {log['date']} \u2014 {phase_label}\n\U0001f4dd {_escape_markdown(log['note'])}\n")
-
-    await query.edit_message_text("\n".join(lines), parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    await query.edit_message_text(_render_history(logs), parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 async def _show_settings(query, context):
-    chat_id = query.message.chat_id
-    db = get_db(context)
-    config = db.get_user_config(chat_id)
-
-    lines = [
-        f"\u2699\ufe0f *Settings, Darling*\n",
-        f"\U0001f4cf Cycle length: *{config['cycle_length']}* days",
-        f"\U0001f4c5 Last period start: *{config['last_period_date']}*",
-        f"\U0001fa78 Period duration: *{config.get('period_duration', 5) or 5}* days",
-    ]
-    yob = config.get("year_of_birth")
-    if yob:
-        lines.append(f"\U0001f382 Birth year: *{yob}* (~{date.today().year - yob} years old)")
-    lines.append(
-        f"\nTo change cycle length:\n`/settings 30`\n"
-        f"To change period duration:\n`/settings period 4`\n"
-        f"To set birth year:\n`/settings age 1995`\n"
-        f"To change period date:\n`/adjust 2026-02-25`"
-    )
-
-    await query.edit_message_text("\n".join(lines), parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    config = _user_config(context, query.message.chat_id)
+    await query.edit_message_text(_render_settings(config, _today(context)), parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 async def _show_chat_intro(query, context):
-    text = (
-        "\U0001f4ac *Chat with Lunaris*\n\n"
-        "Just type anything, darling! No commands needed.\n"
-        "Ask me about your cycle, symptoms, nutrition, exercise, "
-        "hormones, sleep, skin \u2014 anything women's health related \U0001f49b\n\n"
-        "I'll remember our conversation, and you can clear it anytime with /clearchat"
-    )
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    await query.edit_message_text(CHAT_INTRO_TEXT, parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 async def _show_period_confirm(query, context):
-    text = (
-        "\U0001fa78 *Period started today, darling?*\n\n"
-        "I'll reset your cycle and update your cycle length.\n"
-        "If it started on a different day, use:\n`/period 2026-02-25`"
-    )
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=PERIOD_CONFIRM_KEYBOARD)
+    await query.edit_message_text(PERIOD_CONFIRM_TEXT, parse_mode=constants.ParseMode.HTML, reply_markup=PERIOD_CONFIRM_KEYBOARD)
 
 
-def _process_period(db: Database, chat_id: int, period_date: date) -> str:
+def _process_period(context: ContextTypes.DEFAULT_TYPE, chat_id: int, period_date: date) -> str:
     """Common logic for logging a period. Returns the length message."""
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
+    db = get_db(context)
+    last_period, cycle_length, period_duration = _cycle_info(context, chat_id)
+    period_iso = period_date.isoformat()
 
     # Log to period history
-    db.add_period_log(chat_id, period_date.isoformat())
+    db.add_period_log(chat_id, period_iso)
 
     actual_gap = (period_date - last_period).days
 
+    # A duplicate or back-dated start says nothing new about the cycle length,
+    # so skip the history scan entirely
+    if actual_gap <= 0:
+        db.update_user_last_period_date(chat_id, period_iso)
+        return "Cycle length unchanged"
+
     # Try adaptive cycle length from history first
     computed = db.get_computed_cycle_length(chat_id)
     if computed:
         db.update_user_cycle_length(chat_id, computed)
-        length_msg = f"\U0001f4cf Cycle length updated to *{computed}* days (computed from your history)"
-    elif actual_gap > 0 and 18 <= actual_gap <= 45:
+        length_msg = f"\U0001f4cf Cycle length updated to <b>{computed}</b> days (computed from your history)"
+    elif 18 <= actual_gap <= 45:
         new_cycle_length = round(actual_gap * 0.7 + cycle_length * 0.3)
         db.update_user_cycle_length(chat_id, new_cycle_length)
-        length_msg = f"\U0001f4cf Cycle length updated to *{new_cycle_length}* days (this one was {actual_gap} days)"
-    elif actual_gap > 0:
-        length_msg = f"This cycle was {actual_gap} days \u2014 a bit unusual, so I kept the length as is"
+        length_msg = f"\U0001f4cf Cycle length updated to <b>{new_cycle_length}</b> days (this one was {actual_gap} days)"
     else:
-        length_msg = "Cycle length unchanged"
+        length_msg = f"This cycle was {actual_gap} days \u2014 a bit unusual, so I kept the length as is"
 
-    db.update_user_last_period_date(chat_id, period_date.isoformat())
+    db.update_user_last_period_date(chat_id, period_iso)
     return length_msg
 
 
 async def _do_period_today(query, context):
     chat_id = query.message.chat_id
-    db = get_db(context)
-    period_date = date.today()
+    period_date = _today(context)
 
-    length_msg = _process_period(db, chat_id, period_date)
+    length_msg = _process_period(context, chat_id, period_date)
 
     text = (
-        f"\u2705 Got it darling! New period started on *{period_date}*.\n\n"
+        f"\u2705 Got it darling! New period started on <b>{period_date}</b>.\n\n"
         f"{length_msg}\n\n"
         f"Take it easy these next few days \U0001f49b I'm here for you!"
     )
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    await query.edit_message_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
+
+
+# callback_data -> view; defined after all the views it references
+_CALLBACK_DISPATCH = {
+    "menu": _show_menu,
+    "status": _show_status,
+    "tip": _show_tip,
+    "next": _show_next,
+    "phase": _show_phase,
+    "history": _show_history,
+    "settings": _show_settings,
+    "period": _show_period_confirm,
+    "period_confirm": _do_period_today,
+    "chat": _show_chat_intro,
+}
 
 
 # === Command handlers (still work alongside buttons) ===
@@ -605,102 +708,92 @@ async def _do_period_today(query, context):
 @authorized
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
+    view = _current_view(context, chat_id)
+    info = view.info
 
-    text = (
-        f"\U0001f4ca *Your Status, Darling*\n\n"
-        f"\U0001f4c5 Cycle day: *{info['cycle_day']}* of {cycle_length}\n"
-        f"Phase: *{info['label']}*\n\n"
-        f"{info['description']}"
-    )
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    text = STATUS_TEMPLATE.format_map({**info, "cycle_length": view.cycle_length})
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 @authorized
 async def tip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    if not _check_ai_rate_limit(chat_id):
+    if not check_ai_rate_limit(chat_id):
         await update.message.reply_text("Easy there darling, let me catch my breath! Try again in a minute \U0001f49b")
         return
     db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    phase = get_phase(cycle_day, cycle_length, period_duration)
-    recent_logs = db.get_user_recent_logs(chat_id, 3)
+    view = _current_view(context, chat_id)
+    cycle_day, phase = view.cycle_day, view.info["phase"]
 
-    await update.message.reply_text("Hold on darling, thinking... \U0001f914")
+    async with _lock_for(chat_id):
+        placeholder = asyncio.create_task(update.message.reply_text("Hold on darling, thinking... \U0001f914"))
 
-    try:
-        tip = await generate_tip(phase, cycle_day, recent_logs, model="claude-sonnet-4-6")
-        await update.message.reply_text(
-            f"\U0001f4a1 *Tip for You, Darling:*\n\n{tip}",
-            parse_mode="Markdown",
-            reply_markup=TIP_AGAIN_KEYBOARD,
-        )
-    except Exception as e:
-        logger.error(f"AI tip generation failed: {e}")
-        await update.message.reply_text("Oops, my brain froze darling \U0001f605 Try again in a sec!")
+        try:
+            # Read recent logs on a worker thread while the placeholder is sent
+            recent_logs = await asyncio.to_thread(db.get_user_recent_logs_minimal, chat_id, 3)
+            tip = await generate_tip(phase, cycle_day, recent_logs, model="claude-sonnet-4-6")
+            await _settle(placeholder)
+            await update.message.reply_text(
+                f"\U0001f4a1 <b>Tip for You, Darling:</b>\n\n{html.escape(tip, quote=False)}",
+                parse_mode=constants.ParseMode.HTML,
+                reply_markup=TIP_AGAIN_KEYBOARD,
+            )
+        except Exception as e:
+            logger.error("AI tip generation failed: %s", e)
+            await _settle(placeholder)
+            await update.message.reply_text("Oops, my brain froze darling \U0001f605 Try again in a sec!")
 
 
 @authorized
 async def period_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Record that period has started. Resets cycle and learns actual cycle length."""
     chat_id = update.effective_chat.id
-    db = get_db(context)
-
+    today = _today(context)
     if context.args:
         try:
             period_date = date.fromisoformat(context.args[0])
         except ValueError:
             await update.message.reply_text(
                 "Wrong date format darling. Use this:\n"
-                "`/period 2026-02-25`\n\n"
-                "Or just type `/period` to log today \U0001f49b",
-                parse_mode="Markdown",
+                "<code>/period 2026-02-25</code>\n\n"
+                "Or just type <code>/period</code> to log today \U0001f49b",
+                parse_mode=constants.ParseMode.HTML,
             )
             return
-        if period_date > date.today():
+        if period_date > today:
             await update.message.reply_text("That date is in the future, darling! Use a past or today's date.")
             return
     else:
-        period_date = date.today()
+        period_date = today
 
-    length_msg = _process_period(db, chat_id, period_date)
+    length_msg = _process_period(context, chat_id, period_date)
 
     text = (
-        f"\u2705 Got it darling! New period started on *{period_date}*.\n\n"
+        f"\u2705 Got it darling! New period started on <b>{period_date}</b>.\n\n"
         f"{length_msg}\n\n"
         f"Take it easy these next few days \U0001f49b I'm here for you!"
     )
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 @authorized
 async def log_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
-            "\U0001f4dd Write your note, darling:\n`/log feeling tired today`",
-            parse_mode="Markdown",
+            "\U0001f4dd Write your note, darling:\n<code>/log feeling tired today</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
 
     chat_id = update.effective_chat.id
     db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    phase = get_phase(cycle_day, cycle_length, period_duration)
+    info = _current_view(context, chat_id).info
     note = " ".join(context.args)[:MAX_NOTE_LENGTH]
 
-    db.add_user_log(chat_id, note, phase)
+    db.add_user_log(chat_id, note, info["phase"])
     await update.message.reply_text(
-        f"\u2705 Logged, darling!\n\U0001f4dd {_escape_markdown(note)}\n\U0001f300 Phase: {PHASE_LABELS[phase]}",
-        parse_mode="Markdown",
+        f"\u2705 Logged, darling!\n\U0001f4dd {html.escape(note, quote=False)}\n\U0001f300 Phase: {info['label']}",
+        parse_mode=constants.ParseMode.HTML,
         reply_markup=MAIN_KEYBOARD,
     )
 
@@ -718,42 +811,28 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    lines = ["\U0001f4cb *Recent Notes, Darling:*\n"]
-    for log in logs:
-        phase_label = PHASE_LABELS.get(log["phase"], log["phase"])
-        lines.append(f"\U0001f4c5 {log['date']} \u2014 {phase_label}\n\U0001f4dd {_escape_markdown(log['note'])}\n")
-
-    await update.message.reply_text("\n".join(lines), parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    await update.message.reply_text(_render_history(logs), parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 @authorized
 async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    predictions = predict_dates(last_period, cycle_length)
-    today = date.today()
+    last_period, cycle_length, period_duration = _cycle_info(context, chat_id)
+    today = _today(context)
+    predictions = _predict_dates(last_period, cycle_length, today)
 
-    text = (
-        f"\U0001f52e *Upcoming Dates, Darling*\n\n"
-        f"\U0001fa78 Next period: *{predictions['next_period']}* ({days_until(predictions['next_period'], today)} days)\n"
-        f"\u26a1 Next PMS: *{predictions['next_pms']}* ({days_until(predictions['next_pms'], today)} days)\n"
-        f"\u2728 Next ovulation: *{predictions['next_ovulation']}* ({days_until(predictions['next_ovulation'], today)} days)"
-    )
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    text = _render_next(predictions, today)
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 @authorized
 async def phase_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    db = get_db(context)
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    info = get_phase_info(cycle_day, cycle_length, period_duration)
+    view = _current_view(context, chat_id)
+    info = view.info
 
-    text = get_phase_detail(info["phase"], cycle_length, period_duration)
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    text = get_phase_detail(info["phase"], view.cycle_length, view.period_duration)
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 @authorized
@@ -761,8 +840,8 @@ async def adjust_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
             "\U0001f4c5 Enter the start date of your last period, darling:\n"
-            "`/adjust 2026-02-25`",
-            parse_mode="Markdown",
+            "<code>/adjust 2026-02-25</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
 
@@ -770,12 +849,12 @@ async def adjust_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         new_date = date.fromisoformat(context.args[0])
     except ValueError:
         await update.message.reply_text(
-            "Wrong date format darling. Example: `/adjust 2026-02-25`",
-            parse_mode="Markdown",
+            "Wrong date format darling. Example: <code>/adjust 2026-02-25</code>",
+            parse_mode=constants.ParseMode.HTML,
         )
         return
 
-    if new_date > date.today():
+    if new_date > _today(context):
         await update.message.reply_text("That date is in the future, darling! Use a past or today's date.")
         return
 
@@ -783,8 +862,8 @@ async def adjust_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = get_db(context)
     db.update_user_last_period_date(chat_id, new_date.isoformat())
     await update.message.reply_text(
-        f"\u2705 Period start date changed to *{new_date}*, darling!",
-        parse_mode="Markdown",
+        f"\u2705 Period start date changed to <b>{new_date}</b>, darling!",
+        parse_mode=constants.ParseMode.HTML,
         reply_markup=MAIN_KEYBOARD,
     )
 
@@ -793,7 +872,7 @@ async def adjust_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     db = get_db(context)
-    config = db.get_user_config(chat_id)
+    config = _user_config(context, chat_id)
 
     if context.args:
         subcmd = context.args[0].lower()
@@ -809,8 +888,8 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     return
                 db.update_user_period_duration(chat_id, new_duration)
                 await update.message.reply_text(
-                    f"\u2705 Period duration changed to *{new_duration}* days, darling!",
-                    parse_mode="Markdown",
+                    f"\u2705 Period duration changed to <b>{new_duration}</b> days, darling!",
+                    parse_mode=constants.ParseMode.HTML,
                     reply_markup=MAIN_KEYBOARD,
                 )
                 return
@@ -822,7 +901,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if subcmd == "age" and len(context.args) >= 2:
             try:
                 year_of_birth = int(context.args[1])
-                current_year = date.today().year
+                current_year = _today(context).year
                 if not 1940 <= year_of_birth <= current_year - 10:
                     await update.message.reply_text(
                         f"Birth year should be between 1940 and {current_year - 10}, darling."
@@ -831,8 +910,8 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 db.update_user_year_of_birth(chat_id, year_of_birth)
                 age = current_year - year_of_birth
                 await update.message.reply_text(
-                    f"\u2705 Birth year set to *{year_of_birth}* (~{age} years old), darling!",
-                    parse_mode="Markdown",
+                    f"\u2705 Birth year set to <b>{year_of_birth}</b> (~{age} years old), darling!",
+                    parse_mode=constants.ParseMode.HTML,
                     reply_markup=MAIN_KEYBOARD,
                 )
                 return
@@ -848,37 +927,22 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             db.update_user_cycle_length(chat_id, new_length)
             await update.message.reply_text(
-                f"\u2705 Cycle length changed to *{new_length}* days, darling!",
-                parse_mode="Markdown",
+                f"\u2705 Cycle length changed to <b>{new_length}</b> days, darling!",
+                parse_mode=constants.ParseMode.HTML,
                 reply_markup=MAIN_KEYBOARD,
             )
             return
         except ValueError:
             await update.message.reply_text(
                 "Unknown setting, darling. Try:\n"
-                "`/settings 30` \u2014 cycle length\n"
-                "`/settings period 4` \u2014 period duration\n"
-                "`/settings age 1995` \u2014 birth year",
-                parse_mode="Markdown",
+                "<code>/settings 30</code> \u2014 cycle length\n"
+                "<code>/settings period 4</code> \u2014 period duration\n"
+                "<code>/settings age 1995</code> \u2014 birth year",
+                parse_mode=constants.ParseMode.HTML,
             )
             return
 
-    lines = [
-        f"\u2699\ufe0f *Settings, Darling*\n",
-        f"\U0001f4cf Cycle length: *{config['cycle_length']}* days",
-        f"\U0001f4c5 Last period start: *{config['last_period_date']}*",
-        f"\U0001fa78 Period duration: *{config.get('period_duration', 5) or 5}* days",
-    ]
-    yob = config.get("year_of_birth")
-    if yob:
-        lines.append(f"\U0001f382 Birth year: *{yob}* (~{date.today().year - yob} years old)")
-    lines.append(
-        f"\nTo change cycle length:\n`/settings 30`\n"
-        f"To change period duration:\n`/settings period 4`\n"
-        f"To set birth year:\n`/settings age 1995`\n"
-        f"To change period date:\n`/adjust 2026-02-25`"
-    )
-    await update.message.reply_text("\n".join(lines), parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
+    await update.message.reply_text(_render_settings(config, _today(context)), parse_mode=constants.ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
 
 
 # -- About command --
@@ -886,18 +950,33 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @whitelisted
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
-        f"\U0001f319 *Lunaris* \u2014 v{VERSION}\n\n"
+        f"\U0001f319 <b>Lunaris</b> \u2014 v{VERSION}\n\n"
         f"Your personal cycle companion bot.\n"
         f"Tracks your menstrual cycle, predicts upcoming dates, "
         f"and offers AI-powered tips tailored to your current phase.\n\n"
         f"\U0001f469\u200d\U0001f4bb Author: @borghei\n"
         f"\U0001f6e0 Built with: python-telegram-bot, Claude AI, SQLite"
     )
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=BACK_KEYBOARD)
+    await update.message.reply_text(text, parse_mode=constants.ParseMode.HTML, reply_markup=BACK_KEYBOARD)
 
 
 # -- Free-form AI chat handler --
 
+def _store_exchange(context, chat_id: int, message_id: int, user_message: str, response: str) -> asyncio.Future:
+    """Store both sides of a chat turn in one transaction, keyed by the Telegram
+    message id so a redelivered update doesn't duplicate them. Returns a future
+    that resolves once the rows are committed."""
+    rows = [
+        (chat_id, "user", user_message, f"{message_id}:user"),
+        (chat_id, "assistant", response, f"{message_id}:assistant"),
+    ]
+    # Queue on the batched writer when running, else write on a worker thread
+    writer = context.bot_data.get("chat_writer")
+    if writer:
+        return writer.put_many(rows)
+    return asyncio.ensure_future(asyncio.to_thread(get_db(context).add_chat_rows, rows))
+
+
 @authorized
 async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle any non-command text message as a free-form AI chat."""
@@ -905,47 +984,49 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db = get_db(context)
     user_message = update.message.text[:MAX_CHAT_MESSAGE_LENGTH]
 
-    if not _check_ai_rate_limit(chat_id):
-        await update.message.reply_text(
-            "Easy there darling, let me catch my breath! Try again in a minute \U0001f49b"
-        )
-        return
-
     # Get cycle context
-    last_period, cycle_length, period_duration = get_cycle_info(db, chat_id)
-    today = date.today()
-    cycle_day = get_cycle_day(last_period, today, cycle_length)
-    phase = get_phase(cycle_day, cycle_length, period_duration)
-    recent_logs = db.get_user_recent_logs(chat_id, 3)
+    view = _current_view(context, chat_id)
+    today, cycle_day, phase = view.today, view.cycle_day, view.info["phase"]
 
     # Get age if available
-    config = db.get_user_config(chat_id)
+    config = _user_config(context, chat_id)
     year_of_birth = config.get("year_of_birth") if config else None
-    age = date.today().year - year_of_birth if year_of_birth else None
+    age = today.year - year_of_birth if year_of_birth else None
 
-    # Get conversation history
-    history = db.get_chat_history(chat_id, MAX_CHAT_HISTORY)
-
-    # Send typing indicator
-    await context.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING)
+    # Serialize per chat so each message sees the previous turn's history
+    async with _lock_for(chat_id):
+        if not check_ai_rate_limit(chat_id):
+            await update.message.reply_text(
+                "Easy there darling, let me catch my breath! Try again in a minute \U0001f49b"
+            )
+            return
 
-    try:
-        response = await generate_chat_response(
-            user_message=user_message,
-            chat_history=history,
-            cycle_day=cycle_day,
-            phase=phase,
-            recent_logs=recent_logs,
-            age=age,
+        # Read logs and history on a worker thread while the typing indicator is sent
+        (recent_logs, history), _ = await asyncio.gather(
+            asyncio.to_thread(db.get_chat_bundle, chat_id, MAX_CHAT_HISTORY, 3),
+            context.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING),
         )
 
-        # Store both messages in history
-        db.add_chat_message(chat_id, "user", user_message)
-        db.add_chat_message(chat_id, "assistant", response)
+        try:
+            response = await generate_chat_response(
+                user_message=user_message,
+                chat_history=history,
+                cycle_day=cycle_day,
+                phase=phase,
+                recent_logs=recent_logs,
+                age=age,
+            )
+        except Exception as e:
+            logger.error("Chat response generation failed: %s", e)
+            await update.message.reply_text(
+                "Oops, my brain froze for a second darling \U0001f605 Try again?"
+            )
+            return
 
-        await update.message.reply_text(response)
-    except Exception as e:
-        logger.error(f"Chat response generation failed: {e}")
-        await update.message.reply_text(
-            "Oops, my brain froze for a second darling \U0001f605 Try again?"
-        )
+        # Reply without waiting on the write, but hold the chat lock until it
+        # commits so the next message's history includes this turn
+        stored = _store_exchange(context, chat_id, update.message.message_id, user_message, response)
+        try:
+            await update.message.reply_text(response)
+        finally:
+            await stored
@@ -0,0 +1,70 @@
+import time
+from array import array
+
+AI_RATE_LIMIT = 5
+AI_RATE_WINDOW = 60.0
+AI_RATE_SWEEP_EVERY = 256
+
+# Sliding window counter per chat, stored struct-of-arrays: _slots maps a chat
+# to its index in three parallel int64 arrays (window index, calls this window,
+# calls last window). sweep_ai_rate_limits compacts out chats with no calls in
+# the last two windows. Only touch these from the event loop thread: a sweep
+# that interleaves with a check would shift rows under the slot index.
+_slots: dict[int, int] = {}
+_window = array("q")
+_current = array("q")
+_previous = array("q")
+
+
+def check_ai_rate_limit(chat_id: int) -> bool:
+    """Return True if the user is within rate limits."""
+    now = time.monotonic()
+    window, elapsed = divmod(now, AI_RATE_WINDOW)
+    window = int(window)
+    slot = _slots.get(chat_id)
+    if slot is None:
+        if len(_slots) % AI_RATE_SWEEP_EVERY == AI_RATE_SWEEP_EVERY - 1:
+            # Amortized cleanup as new chats arrive, between the scheduled sweeps
+            sweep_ai_rate_limits()
+        slot = _slots[chat_id] = len(_window)
+        _window.append(window)
+        _current.append(0)
+        _previous.append(0)
+    win = _window[slot]
+    if win != window:
+        # Last window's count only carries over if it was the one just before
+        _previous[slot] = _current[slot] if win == window - 1 else 0
+        _current[slot] = 0
+        _window[slot] = window
+    # Previous window's calls count in proportion to how much of it is still in view
+    if _previous[slot] * (1 - elapsed / AI_RATE_WINDOW) + _current[slot] >= AI_RATE_LIMIT:
+        return False
+    _current[slot] += 1
+    return True
+
+
+def sweep_ai_rate_limits() -> int:
+    """Forget chats with no calls in the current or previous window; returns how many were dropped."""
+    window = int(time.monotonic() // AI_RATE_WINDOW)
+    live = [(cid, slot) for cid, slot in _slots.items() if _window[slot] >= window - 1]
+    dropped = len(_slots) - len(live)
+    if dropped:
+        # Rebuild the arrays in place so the module-level references stay valid
+        for column in (_window, _current, _previous):
+            column[:] = array("q", [column[slot] for _, slot in live])
+        _slots.clear()
+        _slots.update((cid, i) for i, (cid, _) in enumerate(live))
+    return dropped
+
+
+async def sweep_ai_rate_limits_job() -> int:
+    """Scheduler entry point. A coroutine so AsyncIOScheduler runs it on the
+    event loop alongside check_ai_rate_limit, not on a worker thread."""
+    return sweep_ai_rate_limits()
+
+
+def reset_ai_rate_limits() -> None:
+    """Forget every chat's counters."""
+    _slots.clear()
+    for column in (_window, _current, _previous):
+        del column[:]
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from datetime import date
 
@@ -8,63 +9,65 @@ from config.settings import REMINDER_HOUR, TIMEZONE
 from src.ai import generate_reminder
 from src.cycle import get_cycle_day, get_phase, get_phase_info
 from src.db import Database
+from src.ratelimit import sweep_ai_rate_limits_job
 
 logger = logging.getLogger(__name__)
 
+REMINDER_CONCURRENCY = 20
+
+
+async def _send_reminder(
+    app: Application, sem: asyncio.Semaphore, chat_id: int, header: str, phase: str,
+    cycle_day: int, recent_logs: list, age: int | None,
+):
+    """Generate and send one user's reminder; failures are logged, not raised."""
+    async with sem:
+        try:
+            tip = await generate_reminder(phase, cycle_day, recent_logs, age=age)
+            await app.bot.send_message(chat_id=chat_id, text=f"{header}\n\n{tip}")
+            logger.info("Sent reminder to %s: day %s, phase %s", chat_id, cycle_day, phase)
+        except Exception as e:
+            logger.error("Failed to send reminder to %s: %s", chat_id, e)
+
 
 async def send_daily_reminder(app: Application):
     """Send daily proactive reminders to all active users with cycle config."""
     db: Database = app.bot_data["db"]
     today = date.today()
 
-    for user in db.get_all_active_users():
-        chat_id = user["chat_id"]
-        config = db.get_user_config(chat_id)
-        if not config:
-            continue
-
+    reminders = []
+    for config in db.get_all_active_users_with_config():
+        chat_id = config["chat_id"]
         last_period = date.fromisoformat(config["last_period_date"])
         cycle_length = config["cycle_length"]
-        period_duration = config.get("period_duration", 5) or 5
-        year_of_birth = config.get("year_of_birth")
+        period_duration = config["period_duration"] or 5
+        year_of_birth = config["year_of_birth"]
         age = today.year - year_of_birth if year_of_birth else None
 
         cycle_day = get_cycle_day(last_period, today, cycle_length)
         phase = get_phase(cycle_day, cycle_length, period_duration)
-        info = get_phase_info(cycle_day, cycle_length, period_duration)
 
         # Proportional PMS warning: 2 days before PMS starts
         pms_start = cycle_length - 6
         pms_warning_day = pms_start - 2
 
         # Determine if we should send a reminder today
-        should_send = False
-        if phase in ("pms", "menstruation"):
-            should_send = True
-        elif phase == "ovulation":
-            should_send = True
-        elif phase == "luteal" and cycle_day == pms_warning_day:
-            should_send = True
-
-        if not should_send:
-            logger.info(f"User {chat_id}: day {cycle_day}, phase {phase} — no reminder needed.")
+        if phase == "luteal" and cycle_day == pms_warning_day:
+            header = "\u26a1 Heads up darling: PMS starts in 2 days! Brace yourself \U0001f49c"
+        elif phase in ("pms", "menstruation", "ovulation"):
+            info = get_phase_info(cycle_day, cycle_length, period_duration)
+            header = f"Good morning darling! \U0001f338\n{info['label']} \u2014 Day {cycle_day}"
+        else:
+            logger.info("User %s: day %s, phase %s — no reminder needed.", chat_id, cycle_day, phase)
             continue
 
-        recent_logs = db.get_user_logs_for_date(chat_id, today) or db.get_user_recent_logs(chat_id, 3)
+        recent_logs = db.get_user_logs_for_date(chat_id, today) or db.get_user_recent_logs_minimal(chat_id, 3)
+        reminders.append((chat_id, header, phase, cycle_day, recent_logs, age))
 
-        try:
-            tip = await generate_reminder(phase, cycle_day, recent_logs, age=age)
-
-            if phase == "luteal" and cycle_day == pms_warning_day:
-                header = "\u26a1 Heads up darling: PMS starts in 2 days! Brace yourself \U0001f49c"
-            else:
-                header = f"Good morning darling! \U0001f338\n{info['label']} \u2014 Day {cycle_day}"
-
-            message = f"{header}\n\n{tip}"
-            await app.bot.send_message(chat_id=chat_id, text=message)
-            logger.info(f"Sent reminder to {chat_id}: day {cycle_day}, phase {phase}")
-        except Exception as e:
-            logger.error(f"Failed to send reminder to {chat_id}: {e}")
+    # AI calls and sends run concurrently; the semaphore keeps the burst within
+    # what the AI API and Telegram's global rate limit will take
+    sem = asyncio.Semaphore(REMINDER_CONCURRENCY)
+    await asyncio.gather(*(_send_reminder(app, sem, *reminder) for reminder in reminders))
 
 
 def setup_scheduler(app: Application) -> AsyncIOScheduler:
@@ -79,4 +82,11 @@ def setup_scheduler(app: Application) -> AsyncIOScheduler:
         id="daily_reminder",
         replace_existing=True,
     )
+    scheduler.add_job(
+        sweep_ai_rate_limits_job,
+        trigger="interval",
+        minutes=5,
+        id="ai_rate_limit_sweep",
+        replace_existing=True,
+    )
     return scheduler
@@ -49,6 +49,8 @@ def mock_context(db_with_user):
     """Mock Telegram context with bot_data['db'] pointing to test DB."""
     context = MagicMock()
     context.bot_data = {"db": db_with_user}
+    context.user_data = {}
+    context.chat_data = {}
     context.args = []
     context.bot = AsyncMock()
     return context
@@ -1,8 +1,12 @@
 from unittest.mock import AsyncMock, MagicMock, patch
 
 from src.ai import (
+    CHAT_SYSTEM_PROMPT,
+    SYSTEM_PROMPT,
+    _build_cycle_context,
     _extract_text,
     _format_logs_context,
+    _get_client,
     generate_tip,
     generate_reminder,
     generate_chat_response,
@@ -46,6 +50,19 @@ class TestFormatLogsContext:
         assert "note 3" not in result
 
 
+# ── _build_cycle_context ─────────────────────────────────────────
+
+class TestBuildCycleContext:
+    def test_empty_without_cycle_info(self):
+        assert _build_cycle_context(None, None, None, ()) == ""
+
+    def test_includes_age_and_notes(self):
+        result = _build_cycle_context(5, "menstruation", 30, ("cramps", "tired"))
+        assert "Day 5, phase: menstruation" in result
+        assert "30 years old" in result
+        assert "- cramps\n- tired" in result
+
+
 # ── generate_tip ─────────────────────────────────────────────────
 
 class TestGenerateTip:
@@ -54,7 +71,7 @@ class TestGenerateTip:
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("Stay warm darling!")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             result = await generate_tip("menstruation", 3)
         assert result == "Stay warm darling!"
         mock_client.messages.create.assert_called_once()
@@ -65,7 +82,7 @@ class TestGenerateTip:
             return_value=mock_anthropic_response("tip")
         )
         logs = [{"note": "tired today"}]
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             await generate_tip("pms", 25, recent_logs=logs)
         call_args = mock_client.messages.create.call_args
         user_msg = call_args.kwargs["messages"][0]["content"]
@@ -76,7 +93,7 @@ class TestGenerateTip:
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("tip")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             await generate_tip("follicular", 10, model="claude-haiku-4-5-20251001")
         call_args = mock_client.messages.create.call_args
         assert call_args.kwargs["model"] == "claude-haiku-4-5-20251001"
@@ -90,7 +107,7 @@ class TestGenerateReminder:
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("Good morning!")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             await generate_reminder("pms", 25)
         call_args = mock_client.messages.create.call_args
         assert call_args.kwargs["model"] == "claude-haiku-4-5-20251001"
@@ -100,12 +117,31 @@ class TestGenerateReminder:
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("cheer up!")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             await generate_reminder("pms", 25)
         call_args = mock_client.messages.create.call_args
         user_msg = call_args.kwargs["messages"][0]["content"]
         assert "PMS" in user_msg
 
+    async def test_system_prompt_sent_plain(self, mock_anthropic_response):
+        mock_client = AsyncMock()
+        mock_client.messages.create = AsyncMock(
+            return_value=mock_anthropic_response("hi")
+        )
+        with patch("src.ai._get_client", return_value=mock_client):
+            await generate_reminder("pms", 25)
+        assert mock_client.messages.create.call_args.kwargs["system"] == SYSTEM_PROMPT
+
+    async def test_default_prompt_for_other_phases(self, mock_anthropic_response):
+        mock_client = AsyncMock()
+        mock_client.messages.create = AsyncMock(
+            return_value=mock_anthropic_response("hi")
+        )
+        with patch("src.ai._get_client", return_value=mock_client):
+            await generate_reminder("luteal", 20)
+        user_msg = mock_client.messages.create.call_args.kwargs["messages"][0]["content"]
+        assert "encouraging and sweet daily message" in user_msg
+
 
 # ── generate_chat_response ───────────────────────────────────────
 
@@ -115,7 +151,7 @@ class TestGenerateChatResponse:
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("reply")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             await generate_chat_response(
                 "How are you?", [], cycle_day=5, phase="menstruation"
             )
@@ -128,20 +164,68 @@ class TestGenerateChatResponse:
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("reply")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             await generate_chat_response(
                 "hi", [], cycle_day=5, phase="menstruation"
             )
         call_args = mock_client.messages.create.call_args
-        system = call_args.kwargs["system"]
+        system = call_args.kwargs["system"][0]["text"]
         assert "Day 5" in system
         assert "menstruation" in system
 
+    async def test_system_prompt_matches_template(self, mock_anthropic_response):
+        mock_client = AsyncMock()
+        mock_client.messages.create = AsyncMock(
+            return_value=mock_anthropic_response("reply")
+        )
+        logs = [{"note": "bloated"}]
+        with patch("src.ai._get_client", return_value=mock_client):
+            await generate_chat_response(
+                "hi", [], cycle_day=20, phase="luteal", recent_logs=logs, age=28
+            )
+        system = mock_client.messages.create.call_args.kwargs["system"][0]["text"]
+        expected_context = _build_cycle_context(20, "luteal", 28, ("bloated",))
+        assert system == CHAT_SYSTEM_PROMPT.format(cycle_context=expected_context)
+
+    async def test_marks_history_prefix_for_caching(self, mock_anthropic_response):
+        mock_client = AsyncMock()
+        mock_client.messages.create = AsyncMock(
+            return_value=mock_anthropic_response("reply")
+        )
+        history = [
+            {"role": "user", "content": "hello"},
+            {"role": "assistant", "content": "hey darling"},
+        ]
+        with patch("src.ai._get_client", return_value=mock_client):
+            await generate_chat_response("how are you?", history)
+        kwargs = mock_client.messages.create.call_args.kwargs
+        assert kwargs["system"][0]["cache_control"] == {"type": "ephemeral"}
+        messages = kwargs["messages"]
+        assert messages[0]["content"] == "hello"
+        assert messages[1]["content"][0]["text"] == "hey darling"
+        assert messages[1]["content"][0]["cache_control"] == {"type": "ephemeral"}
+        assert messages[2]["content"] == "how are you?"
+        # Stored history passed in by the caller is left untouched
+        assert history[1]["content"] == "hey darling"
+
     async def test_handles_no_cycle_context(self, mock_anthropic_response):
         mock_client = AsyncMock()
         mock_client.messages.create = AsyncMock(
             return_value=mock_anthropic_response("reply")
         )
-        with patch("src.ai.client", mock_client):
+        with patch("src.ai._get_client", return_value=mock_client):
             result = await generate_chat_response("hi", [])
         assert result == "reply"
+
+
+# ── _get_client ──────────────────────────────────────────────────
+
+class TestGetClient:
+    def test_client_is_created_once(self):
+        _get_client.cache_clear()
+        with patch("src.ai.anthropic.AsyncAnthropic") as mock_cls:
+            first = _get_client()
+            second = _get_client()
+        _get_client.cache_clear()
+        assert first is second
+        mock_cls.assert_called_once()
@@ -0,0 +1,43 @@
+from unittest.mock import patch
+
+from src.cache import ConfigCache
+
+
+def _loader():
+    calls = []
+
+    def load(chat_id):
+        calls.append(chat_id)
+        return {"chat_id": chat_id, "version": len(calls)}
+    return load, calls
+
+
+class TestConfigCache:
+    def test_hit_skips_loader(self):
+        load, calls = _loader()
+        cache = ConfigCache(load)
+        first = cache.get(1000)
+        assert cache.get(1000) is first
+        assert calls == [1000]
+
+    def test_invalidate_reloads(self):
+        load, calls = _loader()
+        cache = ConfigCache(load)
+        cache.get(1000)
+        cache.invalidate(1000)
+        assert cache.get(1000)["version"] == 2
+
+    def test_entries_expire(self):
+        load, calls = _loader()
+        cache = ConfigCache(load, ttl=10.0)
+        with patch("src.cache.time.monotonic", return_value=100.0):
+            cache.get(1000)
+        with patch("src.cache.time.monotonic", return_value=111.0):
+            assert cache.get(1000)["version"] == 2
+
+    def test_evicts_oldest_when_full(self):
+        load, _ = _loader()
+        cache = ConfigCache(load, maxsize=2)
+        for chat_id in (1000, 2000, 3000):
+            cache.get(chat_id)
+        assert list(cache._entries) == [2000, 3000]
@@ -12,6 +12,10 @@ from src.cycle import (
     PHASE_LABELS,
     PHASE_DESCRIPTIONS,
     PHASE_DETAILS,
+    PHASE_NAMES,
+    OVULATION,
+    _classify_phase,
+    _phase_table,
 )
 
 
@@ -145,6 +149,27 @@ class TestGetPhaseProportional:
         assert phases == {"menstruation", "follicular", "ovulation", "luteal", "pms"}
 
 
+class TestPhaseTable:
+    def test_table_matches_branching_rule(self):
+        for cycle_length in range(20, 46):
+            for period_duration in range(2, 8):
+                table = _phase_table(cycle_length, period_duration)
+                assert len(table) == cycle_length + 1
+                for day in range(cycle_length + 1):
+                    assert table[day] == _classify_phase(day, cycle_length, period_duration)
+
+    def test_phase_names_align_with_labels(self):
+        assert list(PHASE_NAMES) == list(PHASE_LABELS)
+        assert PHASE_NAMES[OVULATION] == "ovulation"
+
+    def test_table_is_cached(self):
+        assert _phase_table(28, 5) is _phase_table(28, 5)
+
+    def test_out_of_range_day_falls_back(self):
+        assert get_phase(29) == "pms"
+        assert get_phase(-1) == "pms"
+
+
 # -- get_phase_info --
 
 class TestGetPhaseInfo:
@@ -212,6 +237,12 @@ class TestGetPhaseDetail:
             detail = get_phase_detail(phase)
             assert len(detail) > 0
 
+    def test_unknown_phase_falls_back_to_empty(self):
+        assert get_phase_detail("unknown") == ""
+
+    def test_detail_texts_reused_per_config(self):
+        assert get_phase_detail("luteal", 30, 4) is get_phase_detail("luteal", 30, 4)
+
 
 # -- predict_dates --
 
@@ -231,6 +262,25 @@ class TestPredictDates:
             result = predict_dates(date(2026, 2, 1), 28)
         assert result["next_period"] > date(2026, 4, 1)
 
+    def test_advances_many_cycles_to_nearest_future(self):
+        fake = _make_fake_date(date(2027, 1, 10))
+        with patch("src.cycle.date", fake):
+            result = predict_dates(date(2026, 2, 1), 28)
+        # Feb 1 2026 + 13 * 28 days = Jan 31 2027, the first start after today
+        assert result["next_period"] == date(2027, 1, 31)
+        assert result["next_pms"] == date(2027, 1, 24)
+        assert result["next_ovulation"] == date(2027, 1, 16)
+
+    def test_explicit_today(self):
+        result = predict_dates(date(2026, 2, 1), 28, today=date(2026, 2, 10))
+        assert result["next_period"] == date(2026, 3, 1)
+
+    def test_period_due_today_rolls_forward(self):
+        fake = _make_fake_date(date(2026, 3, 1))
+        with patch("src.cycle.date", fake):
+            result = predict_dates(date(2026, 2, 1), 28)
+        assert result["next_period"] == date(2026, 3, 29)
+
     def test_custom_cycle_length(self):
         fake = _make_fake_date(date(2026, 2, 10))
         with patch("src.cycle.date", fake):
@@ -1,6 +1,12 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
-from src.db import Database
+import pytest
+
+from src.cycle import PHASE_LABELS
+from src.cache import CONFIG_CACHE_SIZE
+from src.db import SCHEMA_VERSION, ChatHistoryWriter, Database
 
 
 # -- Schema --
@@ -34,6 +40,130 @@ class TestSchema:
         assert "period_duration" in col_names
         assert "year_of_birth" in col_names
 
+    def test_schema_version_stamped(self, db):
+        assert db._get_conn().execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+    def test_reopen_keeps_data(self, tmp_path):
+        Database(tmp_path / "test.db").add_user(100, added_by=1)
+        assert Database(tmp_path / "test.db").is_user_authorized(100)
+
+    def test_upgrades_unversioned_database(self, tmp_path):
+        path = tmp_path / "old.db"
+        conn = sqlite3.connect(path)
+        conn.execute("""
+            CREATE TABLE user_cycle_config (
+                chat_id INTEGER PRIMARY KEY,
+                cycle_length INTEGER NOT NULL DEFAULT 28,
+                last_period_date TEXT NOT NULL
+            )
+        """)
+        conn.execute("INSERT INTO user_cycle_config VALUES (100, 30, '2026-02-01')")
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        config = db.get_user_config(100)
+        assert config["period_duration"] == 5
+        assert config["year_of_birth"] is None
+        assert db._get_conn().execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+    def test_lookup_tables_without_rowid(self, db):
+        for table in ("users", "user_cycle_config"):
+            sql = db._get_conn().execute(
+                "SELECT sql FROM sqlite_master WHERE name = ?", (table,)
+            ).fetchone()[0]
+            assert "WITHOUT ROWID" in sql
+
+    def test_rebuilds_rowid_tables_keeping_data(self, tmp_path):
+        path = tmp_path / "v2.db"
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE users (
+                chat_id INTEGER PRIMARY KEY,
+                added_by INTEGER,
+                is_admin INTEGER NOT NULL DEFAULT 0,
+                is_active INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT NOT NULL DEFAULT (datetime('now'))
+            );
+            CREATE TABLE period_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                period_date TEXT NOT NULL,
+                created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                FOREIGN KEY (chat_id) REFERENCES users(chat_id)
+            );
+            INSERT INTO users (chat_id, is_admin) VALUES (100, 1);
+            INSERT INTO period_logs (chat_id, period_date) VALUES (100, '2026-02-01');
+            PRAGMA user_version = 2;
+        """)
+        conn.close()
+
+        db = Database(path)
+        assert db.is_admin(100)
+        assert db.get_period_history(100) == ["2026-02-01"]
+        assert db._get_conn().execute("PRAGMA foreign_key_check").fetchall() == []
+        with pytest.raises(sqlite3.IntegrityError):
+            db.add_period_log(999, "2026-03-01")
+
+    def test_logs_for_date_uses_covering_index(self, db):
+        plan = db._get_conn().execute(
+            "EXPLAIN QUERY PLAN SELECT date, note, phase FROM user_mood_logs WHERE chat_id = ? AND date = ?",
+            (1, "2026-02-01"),
+        ).fetchall()
+        detail = " ".join(row["detail"] for row in plan)
+        assert "COVERING INDEX idx_user_mood_logs_chat_date" in detail
+
+    def test_tuning_pragmas_on_every_connection(self, db):
+        for conn in (db._get_conn(), db._get_read_conn()):
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+            assert conn.execute("PRAGMA cache_size").fetchone()[0] == -65536
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+            assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+            assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 268435456
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_read_connection_is_read_only(self, db):
+        with pytest.raises(sqlite3.OperationalError):
+            db._get_read_conn().execute("INSERT INTO users (chat_id) VALUES (1)")
+
+    def test_read_connection_sees_committed_writes(self, db):
+        db.add_user(100, added_by=1)
+        row = db._get_read_conn().execute("SELECT chat_id FROM users").fetchone()
+        assert row["chat_id"] == 100
+
+    def test_connections_are_per_thread(self, db):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            worker_conns = executor.submit(lambda: (db._get_conn(), db._get_read_conn())).result()
+            executor.submit(db.bootstrap_admin, 100, 28, "2026-02-01").result()
+        assert worker_conns[0] is not db._get_conn()
+        assert worker_conns[1] is not db._get_read_conn()
+        assert db.is_admin(100)
+
+    def test_worker_connection_enforces_foreign_keys(self, db):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fk = executor.submit(
+                lambda: db._get_conn().execute("PRAGMA foreign_keys").fetchone()[0]
+            ).result()
+        assert fk == 1
+
+
+# -- Transactions --
+
+class TestTransactions:
+    def test_commits_on_success(self, db):
+        with db._txn() as conn:
+            conn.execute("INSERT INTO users (chat_id) VALUES (100)")
+        assert not db._get_conn().in_transaction
+        assert db.is_user_authorized(100)
+
+    def test_rolls_back_on_error(self, db):
+        with pytest.raises(RuntimeError):
+            with db._txn() as conn:
+                conn.execute("INSERT INTO users (chat_id) VALUES (100)")
+                raise RuntimeError("boom")
+        assert not db._get_conn().in_transaction
+        assert not db.is_user_authorized(100)
+
 
 # -- User management --
 
@@ -69,6 +199,47 @@ class TestUserManagement:
     def test_is_user_authorized_false_unknown(self, db):
         assert not db.is_user_authorized(9999)
 
+    def test_authz_cached_after_first_lookup(self, db):
+        db.add_user(100, added_by=1)
+        assert db.is_user_authorized(100)
+        # Bypass the API so only the cache can answer
+        with db._get_conn() as conn:
+            conn.execute("UPDATE users SET is_active = 0 WHERE chat_id = 100")
+        assert db.is_user_authorized(100)
+
+    def test_unknown_user_cache_invalidated_by_add(self, db):
+        assert not db.is_user_authorized(100)
+        db.add_user(100, added_by=1)
+        assert db.is_user_authorized(100)
+
+    def test_admin_cache_invalidated_by_bootstrap(self, db):
+        db.add_user(100, added_by=1)
+        assert not db.is_admin(100)
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        assert db.is_admin(100)
+
+    def test_authz_cache_bounded(self, db):
+        for chat_id in range(CONFIG_CACHE_SIZE + 10):
+            db.is_user_authorized(chat_id)
+        assert len(db._state_cache) == CONFIG_CACHE_SIZE
+
+    def test_auth_checks_share_one_cache(self, db):
+        db.add_user(100, added_by=1)
+        assert db.get_user_state(100)["authorized"] and db.is_user_authorized(100)
+        db.remove_user(100)
+        assert not db.get_user_state(100)["authorized"]
+        assert not db.is_user_authorized(100)
+
+    def test_config_writes_invalidate_state(self, db):
+        db.add_user(100, added_by=1)
+        assert db.get_user_state(100)["config"] is None
+        db.upsert_user_config(100, 28, "2026-02-01")
+        assert db.get_user_state(100)["config"]["cycle_length"] == 28
+        db.update_user_cycle_length(100, 31)
+        db.update_user_year_of_birth(100, 1990)
+        config = db.get_user_state(100)["config"]
+        assert (config["cycle_length"], config["year_of_birth"]) == (31, 1990)
+
     def test_get_all_active_users(self, db):
         db.add_user(100, added_by=1)
         db.add_user(200, added_by=1)
@@ -78,6 +249,16 @@ class TestUserManagement:
         assert 100 in ids
         assert 200 not in ids
 
+    def test_get_all_active_users_with_config(self, db):
+        db.add_user(100, added_by=1)
+        db.add_user(200, added_by=1)
+        db.add_user(300, added_by=1)
+        db.upsert_user_config(100, 28, "2026-02-01", 5, 1995)
+        db.upsert_user_config(200, 30, "2026-02-01")
+        db.remove_user(200)
+        rows = db.get_all_active_users_with_config()
+        assert [(r["chat_id"], r["cycle_length"], r["year_of_birth"]) for r in rows] == [(100, 28, 1995)]
+
     def test_get_all_whitelisted_users(self, db):
         db.add_user(100, added_by=1)
         db.add_user(200, added_by=1)
@@ -170,6 +351,23 @@ class TestCycleConfig:
         config = db.get_user_config(100)
         assert config["year_of_birth"] is None
 
+    def test_user_state_matches_config(self, db):
+        db.add_user(100, added_by=1)
+        db.upsert_user_config(100, 28, "2026-02-01", period_duration=4, year_of_birth=1995)
+        state = db.get_user_state(100)
+        assert state["authorized"] and not state["is_admin"]
+        assert state["config"] == db.get_user_config(100)
+
+    def test_user_state_without_config(self, db):
+        db.add_user(100, added_by=1)
+        assert db.get_user_state(100) == {"authorized": True, "is_admin": False, "config": None}
+
+    def test_user_state_inactive_user(self, db):
+        db.add_user(100, added_by=1)
+        db.upsert_user_config(100, 28, "2026-02-01")
+        db.remove_user(100)
+        assert db.get_user_state(100) == {"authorized": False, "is_admin": False, "config": None}
+
 
 # -- Period logs --
 
@@ -217,6 +415,24 @@ class TestPeriodLogs:
         result = db.get_computed_cycle_length(100)
         assert result == 28  # outlier filtered out
 
+    def test_computed_cycle_length_odd_count_median(self, db):
+        db.add_user(100, added_by=1)
+        for d in ("2026-01-01", "2026-01-27", "2026-02-24", "2026-03-31"):
+            db.add_period_log(100, d)
+        assert db.get_computed_cycle_length(100) == 28  # median of [26, 28, 35]
+
+    def test_computed_cycle_length_even_count_rounds_half_to_even(self, db):
+        db.add_user(100, added_by=1)
+        for d in ("2026-01-01", "2026-01-29", "2026-02-27"):
+            db.add_period_log(100, d)
+        assert db.get_computed_cycle_length(100) == 28  # round(28.5)
+
+    def test_computed_cycle_length_none_when_all_outliers(self, db):
+        db.add_user(100, added_by=1)
+        db.add_period_log(100, "2026-01-01")
+        db.add_period_log(100, "2026-01-10")
+        assert db.get_computed_cycle_length(100) is None
+
     def test_per_user_isolation(self, db):
         db.add_user(100, added_by=1)
         db.add_user(200, added_by=1)
@@ -236,6 +452,21 @@ class TestMoodLogs:
         assert len(logs) == 1
         assert logs[0]["note"] == "feeling great"
 
+    def test_recent_logs_resolve_phase_label(self, db):
+        db.add_user(100, added_by=1)
+        db.add_user_log(100, "legacy", "mystery", date(2026, 2, 9))
+        db.add_user_log(100, "cramps", "menstruation", date(2026, 2, 10))
+        labels = {log["note"]: log["phase_label"] for log in db.get_user_recent_logs(100)}
+        assert labels == {"cramps": PHASE_LABELS["menstruation"], "legacy": "mystery"}
+
+    def test_created_at_matches_sqlite_format(self, db):
+        db.add_user(100, added_by=1)
+        db.add_user_log(100, "feeling great", "follicular")
+        created_at = db.get_user_recent_logs(100)[0]["created_at"]
+        sqlite_now = db._get_conn().execute("SELECT datetime('now')").fetchone()[0]
+        assert len(created_at) == len(sqlite_now)
+        assert created_at[:10] == sqlite_now[:10]
+
     def test_limit(self, db):
         db.add_user(100, added_by=1)
         for i in range(5):
@@ -243,6 +474,12 @@ class TestMoodLogs:
         logs = db.get_user_recent_logs(100, limit=3)
         assert len(logs) == 3
 
+    def test_recent_logs_minimal(self, db):
+        db.add_user(100, added_by=1)
+        db.add_user_log(100, "feeling great", "follicular", date(2026, 2, 10))
+        logs = db.get_user_recent_logs_minimal(100)
+        assert [tuple(log) for log in logs] == [("2026-02-10", "feeling great")]
+
     def test_filter_by_date(self, db):
         db.add_user(100, added_by=1)
         db.add_user_log(100, "note a", "follicular", date(2026, 2, 10))
@@ -282,6 +519,62 @@ class TestChatHistory:
         assert history[0]["content"] == "first"
         assert history[1]["content"] == "second"
 
+    def test_limit_keeps_newest_in_order(self, db):
+        db.add_user(100, added_by=1)
+        for i in range(5):
+            db.add_chat_message(100, "user", f"msg {i}")
+        history = db.get_chat_history(100, limit=3)
+        assert history == [
+            {"role": "user", "content": "msg 2"},
+            {"role": "user", "content": "msg 3"},
+            {"role": "user", "content": "msg 4"},
+        ]
+
+    def test_chat_bundle_matches_single_reads(self, db):
+        db.add_user(100, added_by=1)
+        for i in range(4):
+            db.add_user_log(100, f"note {i}", "pms")
+            db.add_chat_message(100, "user", f"msg {i}")
+        bundle = db.get_chat_bundle(100, history_limit=3, logs_limit=2)
+        assert bundle.history == db.get_chat_history(100, limit=3)
+        assert [dict(r) for r in bundle.recent_logs] == [dict(r) for r in db.get_user_recent_logs_minimal(100, 2)]
+        # The read transaction is closed again
+        assert not db._get_read_conn().in_transaction
+
+    def test_duplicate_client_msg_id_ignored(self, db):
+        db.add_user(100, added_by=1)
+        db.add_chat_message(100, "user", "hello", client_msg_id="42:user")
+        db.add_chat_message(100, "user", "hello", client_msg_id="42:user")
+        assert len(db.get_chat_history(100)) == 1
+
+    def test_messages_without_client_msg_id_not_deduplicated(self, db):
+        db.add_user(100, added_by=1)
+        db.add_chat_message(100, "user", "hello")
+        db.add_chat_message(100, "user", "hello")
+        assert len(db.get_chat_history(100)) == 2
+
+    def test_client_msg_id_scoped_per_chat(self, db):
+        db.add_user(100, added_by=1)
+        db.add_user(200, added_by=1)
+        db.add_chat_message(100, "user", "hello", client_msg_id="42:user")
+        db.add_chat_message(200, "user", "hello", client_msg_id="42:user")
+        assert len(db.get_chat_history(200)) == 1
+
+    def test_add_many_in_order(self, db):
+        db.add_user(100, added_by=1)
+        db.add_chat_messages(100, [("user", "first"), ("assistant", "second")])
+        history = db.get_chat_history(100)
+        assert history == [
+            {"role": "user", "content": "first"},
+            {"role": "assistant", "content": "second"},
+        ]
+
+    def test_add_many_is_atomic(self, db):
+        db.add_user(100, added_by=1)
+        with pytest.raises(sqlite3.IntegrityError):
+            db.add_chat_messages(100, [("user", "ok"), ("system", "bad role")])
+        assert db.get_chat_history(100) == []
+
     def test_clear(self, db):
         db.add_user(100, added_by=1)
         db.add_chat_message(100, "user", "hello")
@@ -296,6 +589,30 @@ class TestChatHistory:
         history = db.get_chat_history(100)
         assert len(history) == 5
         assert history[-1]["content"] == "msg 9"
+        assert history[0]["content"] == "msg 5"
+
+    def test_prune_keeps_all_when_under_limit(self, db):
+        db.add_user(100, added_by=1)
+        for i in range(3):
+            db.add_chat_message(100, "user", f"msg {i}")
+        db.prune_chat_history(100, keep=5)
+        assert len(db.get_chat_history(100)) == 3
+
+    def test_prune_only_touches_own_chat(self, db):
+        db.add_user(100, added_by=1)
+        db.add_user(200, added_by=1)
+        for i in range(4):
+            db.add_chat_message(100, "user", f"a {i}")
+            db.add_chat_message(200, "user", f"b {i}")
+        db.prune_chat_history(100, keep=1)
+        assert len(db.get_chat_history(100)) == 1
+        assert len(db.get_chat_history(200)) == 4
+
+    def test_prune_keep_zero_clears(self, db):
+        db.add_user(100, added_by=1)
+        db.add_chat_message(100, "user", "hello")
+        db.prune_chat_history(100, keep=0)
+        assert db.get_chat_history(100) == []
 
     def test_per_user_isolation(self, db):
         db.add_user(100, added_by=1)
@@ -306,6 +623,64 @@ class TestChatHistory:
         assert len(db.get_chat_history(200)) == 1
 
 
+# -- Batched chat writer --
+
+class TestChatHistoryWriter:
+    async def test_flushes_on_close(self, db):
+        db.add_user(100, added_by=1)
+        writer = ChatHistoryWriter(db)
+        writer.start()
+        writer.put(100, "user", "hello", "1:user")
+        writer.put(100, "assistant", "hi darling", "1:assistant")
+        await writer.aclose()
+        assert [m["content"] for m in db.get_chat_history(100)] == ["hello", "hi darling"]
+
+    async def test_coalesces_into_one_transaction(self, db):
+        db.add_user(100, added_by=1)
+        writer = ChatHistoryWriter(db, flush_interval=0.2)
+        calls = []
+        original = db.add_chat_rows
+        db.add_chat_rows = lambda rows: (calls.append(len(rows)), original(rows))
+        writer.start()
+        for i in range(3):
+            writer.put(100, "user", f"msg {i}")
+        await writer.aclose()
+        assert calls == [3]
+
+    async def test_put_many_stays_in_one_batch(self, db):
+        db.add_user(100, added_by=1)
+        writer = ChatHistoryWriter(db, batch_size=2, flush_interval=0.2)
+        calls = []
+        original = db.add_chat_rows
+        db.add_chat_rows = lambda rows: (calls.append(len(rows)), original(rows))
+        writer.start()
+        writer.put(100, "user", "first")
+        writer.put_many([(100, "user", "q", "2:user"), (100, "assistant", "a", "2:assistant")])
+        await writer.aclose()
+        # The pair is never split across transactions, even past batch_size
+        assert calls == [3]
+        assert [m["content"] for m in db.get_chat_history(100)] == ["first", "q", "a"]
+
+    async def test_put_many_resolves_after_commit(self, db):
+        db.add_user(100, added_by=1)
+        writer = ChatHistoryWriter(db)
+        writer.start()
+        await writer.put_many([(100, "user", "q", "1:user"), (100, "assistant", "a", "1:assistant")])
+        # Visible to a reader as soon as the future resolves, before close
+        assert [m["content"] for m in db.get_chat_history(100)] == ["q", "a"]
+        await writer.aclose()
+
+    async def test_failed_batch_does_not_stop_writer(self, db):
+        db.add_user(100, added_by=1)
+        writer = ChatHistoryWriter(db, flush_interval=0)
+        writer.start()
+        with pytest.raises(sqlite3.IntegrityError):
+            await writer.put(100, "system", "bad role")
+        await writer.put(100, "user", "hello")
+        await writer.aclose()
+        assert [m["content"] for m in db.get_chat_history(100)] == ["hello"]
+
+
 # -- Bootstrap --
 
 class TestBootstrap:
@@ -333,6 +708,18 @@ class TestBootstrap:
         assert config["cycle_length"] == 30
         assert config["last_period_date"] == "2026-01-15"
 
+    def test_keeps_existing_config(self, db):
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        db.update_user_cycle_length(100, 32)
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        assert db.get_user_config(100)["cycle_length"] == 32
+
+    def test_reactivates_removed_admin(self, db):
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        db.remove_user(100)
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        assert db.is_admin(100)
+
     def test_migrates_legacy_mood_logs(self, db):
         with db._get_conn() as conn:
             conn.execute(
@@ -342,3 +729,14 @@ class TestBootstrap:
         logs = db.get_user_recent_logs(100)
         assert len(logs) == 1
         assert logs[0]["note"] == "legacy note"
+
+    def test_legacy_mood_logs_copied_once(self, db):
+        with db._get_conn() as conn:
+            conn.executemany(
+                "INSERT INTO mood_logs (date, note, phase) VALUES (?, ?, 'luteal')",
+                [("2026-02-01", "first"), ("2026-02-02", "second")],
+            )
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        db.bootstrap_admin(100, 28, "2026-02-01")
+        logs = db.get_user_recent_logs(100)
+        assert sorted(log["note"] for log in logs) == ["first", "second"]
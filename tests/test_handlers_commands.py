@@ -1,6 +1,8 @@
-import time
+import asyncio
 from datetime import date
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from telegram.error import BadRequest
 
 from src.handlers import (
     setup_command,
@@ -11,10 +13,12 @@ from src.handlers import (
     settings_command,
     period_command,
     clearchat_command,
+    tip_command,
     chat_handler,
-    _ai_call_timestamps,
-    AI_RATE_LIMIT,
+    button_handler,
+    _ai_locks,
 )
+from src.ratelimit import AI_RATE_LIMIT, check_ai_rate_limit, reset_ai_rate_limits
 
 
 # -- /setup --
@@ -99,6 +103,14 @@ class TestSetupCommand:
         reply = update.message.reply_text.call_args[0][0]
         assert "between" in reply.lower() or "Birth year" in reply
 
+    async def test_non_numeric_birth_year(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        mock_context.args = ["30", "2026-02-03", "5", "abc"]
+        await setup_command(update, mock_context)
+        reply = update.message.reply_text.call_args[0][0]
+        assert reply == "Birth year must be a number, darling."
+        assert mock_context.bot_data["db"].get_user_config(1000)["cycle_length"] == 28
+
 
 # -- /start --
 
@@ -117,6 +129,16 @@ class TestStartCommand:
         reply = update.message.reply_text.call_args[0][0]
         assert "Lunaris" in reply
 
+    async def test_single_config_read(self, make_update, mock_context):
+        db = mock_context.bot_data["db"]
+        update = make_update(chat_id=1000)
+        # The whitelist check and the handler share the cached state: one query
+        with patch.object(db._state_cache, "_loader", wraps=db._state_cache._loader) as load, \
+                patch.object(db, "get_user_config", wraps=db.get_user_config) as get_config:
+            await start_command(update, mock_context)
+        load.assert_called_once_with(1000)
+        get_config.assert_not_called()
+
 
 # -- /log --
 
@@ -135,6 +157,14 @@ class TestLogCommand:
         reply = update.message.reply_text.call_args[0][0]
         assert "Logged" in reply
 
+    async def test_note_is_html_escaped(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        mock_context.args = ["<b>cramps</b>", "&", "*tired*"]
+        await log_command(update, mock_context)
+        reply = update.message.reply_text.call_args[0][0]
+        assert "&lt;b&gt;cramps&lt;/b&gt; &amp; *tired*" in reply
+        assert update.message.reply_text.call_args.kwargs["parse_mode"] == "HTML"
+
 
 # -- /adduser --
 
@@ -164,6 +194,15 @@ class TestRemoveuserCommand:
         reply = update.message.reply_text.call_args[0][0]
         assert "admin" in reply.lower()
 
+    async def test_removed_user_loses_access_immediately(self, make_update, mock_context):
+        db = mock_context.bot_data["db"]
+        assert db.get_user_state(2000)["authorized"] and db.is_user_authorized(2000)
+        update = make_update(chat_id=1000)
+        mock_context.args = ["2000"]
+        await removeuser_command(update, mock_context)
+        assert not db.get_user_state(2000)["authorized"]
+        assert not db.is_user_authorized(2000)
+
 
 # -- /settings --
 
@@ -182,6 +221,24 @@ class TestSettingsCommand:
         reply = update.message.reply_text.call_args[0][0]
         assert "30" in reply
 
+    async def test_update_refreshes_cached_cycle(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        mock_context.args = []
+        await start_command(update, mock_context)
+        mock_context.args = ["30"]
+        await settings_command(update, mock_context)
+        await start_command(update, mock_context)
+        assert mock_context.user_data["_view"].cycle_length == 30
+
+    async def test_view_uses_state_from_decorator(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        mock_context.args = []
+        db = mock_context.bot_data["db"]
+        with patch.object(db, "get_user_config", wraps=db.get_user_config) as get_config:
+            await settings_command(update, mock_context)
+        get_config.assert_not_called()
+        assert db.get_user_state(1000)["config"]["cycle_length"] == 28
+
     async def test_settings_period(self, make_update, mock_context):
         update = make_update(chat_id=1000)
         mock_context.args = ["period", "4"]
@@ -254,6 +311,57 @@ class TestPeriodCommand:
         history = db.get_period_history(1000)
         assert len(history) >= 1
 
+    async def test_reads_config_once(self, make_update, mock_context):
+        db = mock_context.bot_data["db"]
+        update = make_update(chat_id=1000)
+        mock_context.args = []
+        with patch.object(db, "get_user_config", wraps=db.get_user_config) as get_config:
+            await period_command(update, mock_context)
+        get_config.assert_not_called()
+
+    async def test_backdated_period_skips_history_scan(self, make_update, mock_context):
+        db = mock_context.bot_data["db"]
+        update = make_update(chat_id=1000)
+        mock_context.args = ["2026-01-20"]  # before the fixture's 2026-02-01
+        with patch.object(db, "get_computed_cycle_length") as computed:
+            await period_command(update, mock_context)
+        computed.assert_not_called()
+        assert "unchanged" in update.message.reply_text.call_args[0][0]
+        assert db.get_user_config(1000)["last_period_date"] == "2026-01-20"
+
+
+# -- /tip --
+
+class TestTipCommand:
+    def setup_method(self):
+        reset_ai_rate_limits()
+
+    async def test_placeholder_sent_before_tip(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        with patch("src.handlers.generate_tip", new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Drink water & rest"
+            await tip_command(update, mock_context)
+        replies = [c.args[0] for c in update.message.reply_text.call_args_list]
+        assert replies[0].startswith("Hold on darling")
+        assert "Drink water &amp; rest" in replies[1]
+
+    async def test_passes_recent_logs(self, make_update, mock_context):
+        mock_context.bot_data["db"].add_user_log(1000, "bloated", "pms", date(2026, 2, 10))
+        update = make_update(chat_id=1000)
+        with patch("src.handlers.generate_tip", new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Stay cozy"
+            await tip_command(update, mock_context)
+        recent_logs = mock_ai.call_args.args[2]
+        assert [log["note"] for log in recent_logs] == ["bloated"]
+
+    async def test_failed_placeholder_does_not_block_tip(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        update.message.reply_text.side_effect = [BadRequest("flood"), None]
+        with patch("src.handlers.generate_tip", new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "Stay cozy"
+            await tip_command(update, mock_context)
+        assert "Stay cozy" in update.message.reply_text.call_args.args[0]
+
 
 # -- /clearchat --
 
@@ -268,11 +376,29 @@ class TestClearchatCommand:
         assert "cleared" in reply.lower()
 
 
+# -- button_handler --
+
+class TestButtonHandler:
+    async def test_dispatches_to_view(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        update.callback_query.data = "status"
+        await button_handler(update, mock_context)
+        text = update.callback_query.edit_message_text.call_args[0][0]
+        assert "Your Status" in text
+
+    async def test_unknown_data_only_answers(self, make_update, mock_context):
+        update = make_update(chat_id=1000)
+        update.callback_query.data = "bogus"
+        await button_handler(update, mock_context)
+        update.callback_query.answer.assert_awaited_once()
+        update.callback_query.edit_message_text.assert_not_called()
+
+
 # -- chat_handler --
 
 class TestChatHandler:
     def setup_method(self):
-        _ai_call_timestamps.clear()
+        reset_ai_rate_limits()
 
     async def test_stores_messages(self, make_update, mock_context):
         update = make_update(chat_id=1000, text="How are you?")
@@ -284,10 +410,79 @@ class TestChatHandler:
         assert any(m["content"] == "How are you?" for m in history)
         assert any(m["content"] == "I'm great darling!" for m in history)
 
+    async def test_queues_messages_on_writer(self, make_update, mock_context):
+        writer = MagicMock()
+        committed = asyncio.get_running_loop().create_future()
+        committed.set_result(None)
+        writer.put_many.return_value = committed
+        mock_context.bot_data["chat_writer"] = writer
+        update = make_update(chat_id=1000, text="How are you?")
+        update.message.message_id = 7
+        with patch("src.handlers.generate_chat_response", new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "I'm great darling!"
+            await chat_handler(update, mock_context)
+        writer.put_many.assert_called_once_with([
+            (1000, "user", "How are you?", "7:user"),
+            (1000, "assistant", "I'm great darling!", "7:assistant"),
+        ])
+
+    async def test_replies_before_commit_and_holds_lock(self, make_update, mock_context):
+        committed = asyncio.get_running_loop().create_future()
+        writer = MagicMock()
+        writer.put_many.return_value = committed
+        mock_context.bot_data["chat_writer"] = writer
+        update = make_update(chat_id=1000, text="How are you?")
+        with patch("src.handlers.generate_chat_response", new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "I'm great darling!"
+            task = asyncio.create_task(chat_handler(update, mock_context))
+            for _ in range(100):
+                if update.message.reply_text.await_count:
+                    break
+                await asyncio.sleep(0.01)
+            # The reply is out, but the next message waits for the commit
+            update.message.reply_text.assert_awaited_once_with("I'm great darling!")
+            assert not task.done()
+            lock = _ai_locks[1000]
+            assert lock.locked()
+            committed.set_result(None)
+            await task
+        assert not lock.locked()
+
+    async def test_fetches_context_and_sends_typing(self, make_update, mock_context):
+        db = mock_context.bot_data["db"]
+        db.add_user_log(1000, "bloated", "pms", date(2026, 2, 10))
+        db.add_chat_message(1000, "user", "earlier")
+        update = make_update(chat_id=1000, text="hi")
+        with patch("src.handlers.generate_chat_response", new_callable=AsyncMock) as mock_ai:
+            mock_ai.return_value = "hey"
+            await chat_handler(update, mock_context)
+        kwargs = mock_ai.call_args.kwargs
+        assert [m["content"] for m in kwargs["chat_history"]] == ["earlier"]
+        assert kwargs["recent_logs"][0]["note"] == "bloated"
+        mock_context.bot.send_chat_action.assert_awaited_once()
+
     async def test_rate_limited(self, make_update, mock_context):
         for _ in range(AI_RATE_LIMIT):
-            _ai_call_timestamps[1000].append(time.monotonic())
+            check_ai_rate_limit(1000)
         update = make_update(chat_id=1000, text="hello")
         await chat_handler(update, mock_context)
         reply = update.message.reply_text.call_args[0][0]
         assert "breath" in reply.lower()
+
+    async def test_overlapping_messages_are_serialized(self, make_update, mock_context):
+        seen_history = []
+
+        async def fake_ai(user_message, chat_history, **kwargs):
+            seen_history.append(len(chat_history))
+            await asyncio.sleep(0)
+            return f"re: {user_message}"
+
+        first = make_update(chat_id=1000, text="one")
+        first.message.message_id = 1
+        second = make_update(chat_id=1000, text="two")
+        second.message.message_id = 2
+        with patch("src.handlers.generate_chat_response", side_effect=fake_ai):
+            await asyncio.gather(chat_handler(first, mock_context), chat_handler(second, mock_context))
+        # The second call waits for the first and sees its stored exchange
+        assert seen_history == [0, 2]
+        assert not _ai_locks
@@ -1,82 +1,151 @@
-import time
 from datetime import date
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from telegram import InlineKeyboardMarkup
 
 from src.handlers import (
-    _escape_markdown,
-    _check_ai_rate_limit,
-    _ai_call_timestamps,
-    get_cycle_info,
+    _current_view,
+    _cycle_info,
+    _phase_info,
+    _render_history,
+    _render_next,
+    _render_settings,
+    _render_user_row,
+    _today,
+    _predict_dates,
+    prepare_update,
     whitelisted,
     authorized,
     authorized_callback,
     admin_only,
-    AI_RATE_LIMIT,
+    BACK_KEYBOARD,
+    HISTORY_HEADER,
+    MAIN_KEYBOARD,
+    _DENIED_REPLY,
+    _NEEDS_SETUP_REPLY,
 )
 
 
-# -- _escape_markdown --
-
-class TestEscapeMarkdown:
-    def test_asterisks(self):
-        assert _escape_markdown("*bold*") == "\\*bold\\*"
-
-    def test_underscores(self):
-        assert _escape_markdown("_italic_") == "\\_italic\\_"
-
-    def test_backticks(self):
-        assert _escape_markdown("`code`") == "\\`code\\`"
-
-    def test_brackets(self):
-        assert _escape_markdown("[link]") == "\\[link]"
-
-    def test_plain_text(self):
-        assert _escape_markdown("hello world") == "hello world"
-
-    def test_multiple_chars(self):
-        assert _escape_markdown("*_`[") == "\\*\\_\\`\\["
-
-
-# -- _check_ai_rate_limit --
-
-class TestCheckAiRateLimit:
-    def setup_method(self):
-        _ai_call_timestamps.clear()
-
-    def test_allows_first_call(self):
-        assert _check_ai_rate_limit(100) is True
-
-    def test_allows_up_to_limit(self):
-        for _ in range(AI_RATE_LIMIT):
-            assert _check_ai_rate_limit(100) is True
-
-    def test_blocks_after_limit(self):
-        for _ in range(AI_RATE_LIMIT):
-            _check_ai_rate_limit(100)
-        assert _check_ai_rate_limit(100) is False
-
-    def test_per_user(self):
-        for _ in range(AI_RATE_LIMIT):
-            _check_ai_rate_limit(100)
-        assert _check_ai_rate_limit(200) is True
-
-    def test_expires_old_timestamps(self):
-        for _ in range(AI_RATE_LIMIT):
-            _check_ai_rate_limit(100)
-        # Manually backdate all timestamps beyond the rate window
-        _ai_call_timestamps[100] = [time.monotonic() - 120 for _ in range(AI_RATE_LIMIT)]
-        assert _check_ai_rate_limit(100) is True
+# -- _cycle_info --
 
-
-# -- get_cycle_info --
-
-class TestGetCycleInfo:
-    def test_returns_correct_tuple(self, db_with_user):
-        last_period, cycle_length, period_duration = get_cycle_info(db_with_user, 1000)
+class TestCycleInfoCache:
+    def test_returns_correct_tuple(self, mock_context):
+        last_period, cycle_length, period_duration = _cycle_info(mock_context, 1000)
         assert last_period == date(2026, 2, 1)
         assert cycle_length == 28
         assert period_duration == 5
 
+    def test_reuses_cached_value(self, mock_context):
+        first = _cycle_info(mock_context, 1000)
+        assert _cycle_info(mock_context, 1000) is first
+
+    def test_config_write_reparses(self, mock_context):
+        _cycle_info(mock_context, 1000)
+        mock_context.bot_data["db"].update_user_cycle_length(1000, 32)
+        assert _cycle_info(mock_context, 1000)[1] == 32
+
+    def test_state_cache_expiry_reparses(self, mock_context):
+        # A write from outside the process only shows up once the entry expires
+        db = mock_context.bot_data["db"]
+        _cycle_info(mock_context, 1000)
+        with db._txn() as conn:
+            conn.execute("UPDATE user_cycle_config SET cycle_length = 32 WHERE chat_id = 1000")
+        assert _cycle_info(mock_context, 1000)[1] == 28
+        db._state_cache.clear()
+        assert _cycle_info(mock_context, 1000)[1] == 32
+
+
+class TestTodayPin:
+    async def test_prepare_update_pins_today(self, make_update, mock_context):
+        await prepare_update(make_update(), mock_context)
+        assert mock_context.chat_data["_today"] == date.today()
+
+    def test_today_reads_pinned_date(self, mock_context):
+        mock_context.chat_data["_today"] = date(2026, 2, 10)
+        assert _today(mock_context) == date(2026, 2, 10)
+
+    def test_today_falls_back_without_pin(self, mock_context):
+        assert _today(mock_context) == date.today()
+
+
+class TestCurrentView:
+    def test_reused_within_a_day(self, mock_context):
+        view = _current_view(mock_context, 1000)
+        assert view.today == date.today()
+        assert view.info["cycle_day"] == view.cycle_day
+        assert _current_view(mock_context, 1000) is view
+
+    def test_recomputed_on_new_day(self, mock_context):
+        stale = _current_view(mock_context, 1000)._replace(today=date(2000, 1, 1))
+        mock_context.user_data["_view"] = stale
+        assert _current_view(mock_context, 1000).today == date.today()
+
+    def test_recomputed_after_config_write(self, mock_context):
+        view = _current_view(mock_context, 1000)
+        mock_context.bot_data["db"].update_user_cycle_length(1000, 32)
+        assert _current_view(mock_context, 1000) is not view
+        assert _current_view(mock_context, 1000).cycle_length == 32
+
+
+class TestMemoizedCycleHelpers:
+    def test_phase_info_cached(self):
+        assert _phase_info(3, 28, 5) is _phase_info(3, 28, 5)
+        assert _phase_info(3, 28, 5)["phase"] == "menstruation"
+
+    def test_predict_dates_keyed_on_today(self):
+        first = _predict_dates(date(2026, 2, 1), 28, date(2026, 2, 10))
+        later = _predict_dates(date(2026, 2, 1), 28, date(2026, 3, 10))
+        assert first["next_period"] == date(2026, 3, 1)
+        assert later["next_period"] == date(2026, 3, 29)
+
+
+class TestTemplates:
+    def test_render_next(self):
+        predictions = {
+            "next_period": date(2026, 3, 1),
+            "next_pms": date(2026, 2, 22),
+            "next_ovulation": date(2026, 2, 14),
+        }
+        text = _render_next(predictions, date(2026, 2, 10))
+        assert "Next period: <b>2026-03-01</b> (19 days)" in text
+        assert "Next ovulation: <b>2026-02-14</b> (4 days)" in text
+
+    def test_render_settings_without_birth_year(self):
+        text = _render_settings(
+            {"cycle_length": 28, "last_period_date": "2026-02-01", "period_duration": None}, date(2026, 2, 10)
+        )
+        assert "Period duration: <b>5</b> days" in text
+        assert "Birth year" not in text
+        assert text.endswith("<code>/adjust 2026-02-25</code>")
+
+    def test_render_settings_age_uses_given_day(self):
+        config = {"cycle_length": 28, "last_period_date": "2026-02-01", "period_duration": 5, "year_of_birth": 1995}
+        assert "(~31 years old)" in _render_settings(config, date(2026, 12, 31))
+        assert "(~32 years old)" in _render_settings(config, date(2027, 1, 1))
+
+    def test_render_user_row(self):
+        assert _render_user_row({"chat_id": 42, "is_active": 1, "is_admin": 1}) == "\u2705 <code>42</code> (admin)"
+        assert _render_user_row({"chat_id": 7, "is_active": 0, "is_admin": 0}) == "\u274c <code>7</code>"
+
+    def test_render_history(self):
+        logs = [
+            {"date": "2026-02-10", "phase_label": "\u26a1 PMS", "note": "tired & cranky"},
+            {"date": "2026-02-09", "phase_label": "unknown", "note": "ok"},
+        ]
+        text = _render_history(logs)
+        assert text.startswith(HISTORY_HEADER)
+        assert "\U0001f4dd tired &amp; cranky\n" in text
+        assert "2026-02-09 \u2014 unknown" in text
+
+
+class TestStaticKeyboards:
+    def test_serialized_once(self):
+        assert MAIN_KEYBOARD.to_dict() is MAIN_KEYBOARD.to_dict()
+
+    def test_matches_plain_markup(self):
+        for keyboard in (MAIN_KEYBOARD, BACK_KEYBOARD):
+            assert keyboard.to_dict() == InlineKeyboardMarkup(keyboard.inline_keyboard).to_dict()
+
 
 # -- @whitelisted --
 
@@ -117,7 +186,17 @@ class TestAuthorizedDecorator:
 
         result = await handler(update, mock_context)
         assert result is None
-        update.message.reply_text.assert_called_once()
+        update.message.reply_text.assert_called_once_with(**_NEEDS_SETUP_REPLY)
+
+    async def test_blocks_unknown_user(self, make_update, mock_context):
+        update = make_update(chat_id=9999)
+
+        @authorized
+        async def handler(update, context):
+            return "ok"
+
+        assert await handler(update, mock_context) is None
+        update.message.reply_text.assert_called_once_with(**_DENIED_REPLY)
 
     async def test_allows_with_config(self, make_update, mock_context):
         update = make_update(chat_id=1000)
@@ -0,0 +1,92 @@
+import math
+from unittest.mock import patch
+
+from src import ratelimit
+from src.ratelimit import (
+    AI_RATE_LIMIT,
+    AI_RATE_SWEEP_EVERY,
+    AI_RATE_WINDOW,
+    check_ai_rate_limit,
+    reset_ai_rate_limits,
+    sweep_ai_rate_limits,
+)
+
+
+# -- check_ai_rate_limit --
+
+def _at_window(window, fraction=0.0):
+    return patch("src.ratelimit.time.monotonic", return_value=AI_RATE_WINDOW * (window + fraction))
+
+
+class TestCheckAiRateLimit:
+    def setup_method(self):
+        reset_ai_rate_limits()
+
+    def test_allows_first_call(self):
+        assert check_ai_rate_limit(100) is True
+
+    def test_allows_up_to_limit(self):
+        for _ in range(AI_RATE_LIMIT):
+            assert check_ai_rate_limit(100) is True
+
+    def test_blocks_after_limit(self):
+        for _ in range(AI_RATE_LIMIT):
+            check_ai_rate_limit(100)
+        assert check_ai_rate_limit(100) is False
+
+    def test_per_user(self):
+        for _ in range(AI_RATE_LIMIT):
+            check_ai_rate_limit(100)
+        assert check_ai_rate_limit(200) is True
+
+    def test_resets_after_two_windows(self):
+        with _at_window(10):
+            for _ in range(AI_RATE_LIMIT):
+                check_ai_rate_limit(100)
+        with _at_window(12):
+            assert check_ai_rate_limit(100) is True
+
+    def test_previous_window_is_weighted(self):
+        with _at_window(9):
+            for _ in range(AI_RATE_LIMIT):
+                check_ai_rate_limit(100)
+        # A full previous window counts as half the limit midway through this one
+        with _at_window(10, 0.5):
+            allowed = sum(check_ai_rate_limit(100) for _ in range(AI_RATE_LIMIT))
+        assert allowed == math.ceil(AI_RATE_LIMIT / 2)
+
+    def test_sweep_drops_idle_chats(self):
+        with _at_window(8):
+            check_ai_rate_limit(100)
+        with _at_window(9):
+            check_ai_rate_limit(200)
+        with _at_window(10):
+            assert sweep_ai_rate_limits() == 1
+            assert ratelimit._slots == {200: 0}
+            assert list(ratelimit._window) == [9]
+            # Surviving chat keeps its count after compaction
+            for _ in range(AI_RATE_LIMIT - 1):
+                check_ai_rate_limit(200)
+            assert check_ai_rate_limit(200) is False
+
+    def test_new_chat_triggers_sweep_when_table_grows(self):
+        with _at_window(8):
+            for cid in range(AI_RATE_SWEEP_EVERY - 1):
+                check_ai_rate_limit(cid)
+        with _at_window(10):
+            assert check_ai_rate_limit(10_000) is True
+        assert list(ratelimit._slots) == [10_000]
+
+    def test_amortized_sweep_keeps_counts_with_their_chat(self):
+        # Chats 0..253 go idle; 1000 stays active with a full window
+        with _at_window(8):
+            for cid in range(AI_RATE_SWEEP_EVERY - 2):
+                check_ai_rate_limit(cid)
+        with _at_window(10):
+            for _ in range(AI_RATE_LIMIT):
+                check_ai_rate_limit(1000)
+            # The next new chat triggers the compaction mid-check
+            assert check_ai_rate_limit(2000) is True
+            assert ratelimit._slots == {1000: 0, 2000: 1}
+            assert check_ai_rate_limit(1000) is False
+            assert check_ai_rate_limit(2000) is True
@@ -1,3 +1,4 @@
+import inspect
 from datetime import date
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -94,6 +95,41 @@ class TestSendDailyReminder:
 
         app.bot.send_message.assert_called()
 
+    async def test_one_failure_does_not_block_others(self, db_with_user):
+        app = MagicMock()
+        app.bot_data = {"db": db_with_user}
+        app.bot = AsyncMock()
+
+        # Both users in PMS; the AI fails for 1000 only
+        db_with_user.update_user_last_period_date(1000, "2026-01-28")
+        db_with_user.update_user_last_period_date(2000, "2026-01-28")
+
+        async def fake_reminder(phase, cycle_day, recent_logs, age=None):
+            if fake_reminder.calls == 0:
+                fake_reminder.calls += 1
+                raise Exception("API error")
+            return "Hang in there"
+        fake_reminder.calls = 0
+
+        with patch("src.scheduler.date") as mock_date, \
+             patch("src.scheduler.generate_reminder", side_effect=fake_reminder):
+            mock_date.today.return_value = date(2026, 2, 21)
+            mock_date.fromisoformat = date.fromisoformat
+            await send_daily_reminder(app)
+
+        app.bot.send_message.assert_awaited_once()
+
+    async def test_reads_configs_in_one_query(self, db_with_user):
+        app = MagicMock()
+        app.bot_data = {"db": db_with_user}
+        app.bot = AsyncMock()
+
+        with patch.object(db_with_user, "get_user_config") as get_config, \
+             patch("src.scheduler.generate_reminder", new_callable=AsyncMock):
+            await send_daily_reminder(app)
+
+        get_config.assert_not_called()
+
 
 class TestSetupScheduler:
     def test_creates_job(self):
@@ -101,3 +137,10 @@ class TestSetupScheduler:
         scheduler = setup_scheduler(app)
         jobs = scheduler.get_jobs()
         assert any(j.id == "daily_reminder" for j in jobs)
+
+    def test_creates_rate_limit_sweep_job(self):
+        app = MagicMock()
+        scheduler = setup_scheduler(app)
+        job = scheduler.get_job("ai_rate_limit_sweep")
+        # A coroutine job runs on the event loop, where the limiter state lives
+        assert inspect.iscoroutinefunction(job.func)